@@ -0,0 +1,97 @@
+import asyncio
+import random
+import time
+
+import discord
+
+
+# per-route token bucket, roughly mirroring discord's rate limit buckets
+class Bucket():
+	def __init__(self, rate, per):
+		self.rate = rate
+		self.per = per
+		self.tokens = rate
+		self.updated = time.monotonic()
+		self.lock = asyncio.Lock()
+
+	async def acquire(self):
+		async with self.lock:
+			while True:
+				now = time.monotonic()
+				self.tokens = min(self.rate, self.tokens+(now-self.updated)*self.rate/self.per)
+				self.updated = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				await asyncio.sleep((1-self.tokens)*self.per/self.rate)
+
+
+# discord actions run concurrently under a bounded semaphore, rate limited per route and retried with backoff
+# role changes share their guild's bucket and are coalesced per member and role until they run
+class ActionQueue():
+	def __init__(self, concurrency=4, rate=5, per=5.0, retries=3, backoff=1.0):
+		self.semaphore = asyncio.Semaphore(concurrency)
+		self.rate = rate
+		self.per = per
+		self.retries = retries
+		self.backoff = backoff
+		self.buckets = {}
+		self.pending_roles = {}
+
+	def bucket(self, route):
+		if route not in self.buckets:
+			self.buckets[route] = Bucket(self.rate, self.per)
+		return self.buckets[route]
+
+	# only the request itself holds a slot, so a throttled or backing off route never blocks the others
+	async def run(self, route, action):
+		for attempt in range(self.retries+1):
+			await self.bucket(route).acquire()
+			try:
+				async with self.semaphore:
+					return await action()
+			except discord.HTTPException as e:
+				if attempt >= self.retries or (e.status != 429 and e.status < 500):
+					raise
+			await asyncio.sleep(self.backoff*2**attempt+random.random())
+
+	async def set_role(self, member, role, has_role):
+		key = (member.id, role.id)
+		if key in self.pending_roles:
+			pending = self.pending_roles[key]
+			pending['has_role'] = has_role
+			try:
+				return await asyncio.shield(pending['future'])
+			except asyncio.CancelledError:
+				# the caller we were riding on was cancelled, not us, so queue the change again
+				if not pending['future'].cancelled():
+					raise
+				return await self.set_role(member, role, has_role)
+
+		pending = self.pending_roles[key] = {'has_role': has_role, 'future': asyncio.get_running_loop().create_future()}
+		try:
+			result = await self.run(('roles', member.guild.id), lambda: self.apply_role(key, pending, member, role))
+		except BaseException as e:
+			if self.pending_roles.get(key) is pending:
+				del self.pending_roles[key]
+			if isinstance(e, asyncio.CancelledError):
+				pending['future'].cancel()
+			else:
+				pending['future'].set_exception(e)
+				pending['future'].exception()
+			raise
+		pending['future'].set_result(result)
+		return result
+
+	async def apply_role(self, key, pending, member, role):
+		# later requests for this member and role queue up behind this one once it starts
+		if self.pending_roles.get(key) is pending:
+			del self.pending_roles[key]
+		has_role = pending['has_role']
+		if (role in member.roles) == has_role:
+			return False
+		if has_role:
+			await member.add_roles(role)
+		else:
+			await member.remove_roles(role)
+		return True
@@ -0,0 +1,77 @@
+# per-member message counts in daily buckets, kept in memory and rolled up to the activity table
+# messages still holds each member's latest sent_at, which is all inactivity needs
+
+DAY = 60*60*24
+
+SCHEMA = "activity (member int, day int, messages int, PRIMARY KEY (member, day)) WITHOUT ROWID"
+
+
+class ActivityLedger():
+	def __init__(self, days=28):
+		self.days = days
+		self.last_seen = {}
+		self.buckets = {}
+		self.unsaved_seen = {}
+		self.unsaved_counts = {}
+
+	def record(self, member, sent_at, count=1):
+		if self.last_seen.get(member, 0) < sent_at:
+			self.last_seen[member] = sent_at
+			self.unsaved_seen[member] = sent_at
+		day = sent_at // DAY
+		self.bump(member, day, count)
+		self.unsaved_counts[(member, day)] = self.unsaved_counts.get((member, day), 0)+count
+
+	# each member has a ring of self.days buckets and the newest day written to it
+	def bump(self, member, day, count):
+		if member not in self.buckets:
+			self.buckets[member] = [day, [0]*self.days]
+		ring = self.buckets[member]
+		if day > ring[0]:
+			for d in range(max(ring[0]+1, day-self.days+1), day+1):
+				ring[1][d % self.days] = 0
+			ring[0] = day
+		elif day <= ring[0]-self.days:
+			return
+		ring[1][day % self.days] += count
+
+	def count(self, member, days, now):
+		ring = self.buckets.get(member)
+		if not ring:
+			return 0
+		today = now // DAY
+		first = max(today-days+1, ring[0]-self.days+1)
+		return sum(ring[1][d % self.days] for d in range(first, min(today, ring[0])+1))
+
+	def inactive_since(self, members, cutoff):
+		return [m for m in members if self.last_seen.get(m, cutoff+1) <= cutoff]
+
+	def __len__(self):
+		return len(self.unsaved_counts)
+
+	# hands back what hasn't been written yet as (seen rows, count rows) and forgets it
+	def drain(self):
+		seen = [(sent_at, member) for member,sent_at in self.unsaved_seen.items()]
+		counts = [(member, day, n) for (member,day),n in self.unsaved_counts.items()]
+		self.unsaved_seen = {}
+		self.unsaved_counts = {}
+		return seen, counts
+
+	def seed(self, seen, counts):
+		for member,sent_at in seen:
+			if self.last_seen.get(member, 0) < sent_at:
+				self.last_seen[member] = sent_at
+		for member,day,n in counts:
+			self.bump(member, day, n)
+
+
+def save(con, seen, counts):
+	con.executemany("INSERT OR REPLACE INTO messages (sent_at, sent_by) VALUES (?,?)", seen)
+	con.executemany("INSERT INTO activity (member, day, messages) VALUES (?,?,?) ON CONFLICT (member, day) DO UPDATE SET messages = messages + excluded.messages", counts)
+
+
+# what seed() needs to rebuild the ledger at startup
+def load(con, days, now):
+	seen = con.execute("SELECT sent_by, sent_at FROM messages").fetchall()
+	counts = con.execute("SELECT member, day, messages FROM activity WHERE day > ?", [now // DAY - days]).fetchall()
+	return seen, counts
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# offline benchmarks for the bot's compute paths over synthetic databases and fake guilds
+#
+#   python bench.py --sizes 100,1000,10000 --shapes wide,deep
+#   python bench.py --save bench_baseline.json
+#   python bench.py --compare bench_baseline.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import fakediscord
+import genealogy
+from actions import ActionQueue
+from bot import Bot
+from nameindex import NameIndex
+
+DAY = 60*60*24
+MAX_DEPTH = 200
+
+
+def random_name():
+	return ''.join(random.choices(string.ascii_lowercase, k=random.randint(4,10)))
+
+
+# wide: parents drawn from everyone so far; deep: parents drawn from the newest few, up to MAX_DEPTH generations
+def pick_parent(shape, i, depth):
+	if shape == 'deep':
+		parent = max(0, i-random.randint(1,5))
+		if depth[parent] < MAX_DEPTH:
+			return parent
+	return random.randrange(i)
+
+
+def populate(con, members, shape, now):
+	ids = [m.id for m in members]
+	depth = [0, 0]
+	rows = [("", ids[0], ids[0], now-DAY*len(ids), None, None), ("", ids[1], ids[1], now-DAY*len(ids), None, None)]
+	for i in range(2, len(ids)):
+		parent = pick_parent(shape, i, depth)
+		depth.append(depth[parent]+1)
+		t = now-(len(ids)-i)*60
+		rows.append(("https://discord.gg/"+random_name(), ids[parent], ids[i], t, t+30, None))
+	con.executemany("INSERT INTO bestowments (link, bestower, bestowee, given_to_bestower_at, bestowee_joined_at, released_at) VALUES (?,?,?,?,?,?)", rows)
+	con.executemany("INSERT OR REPLACE INTO messages (sent_at, sent_by) VALUES (?,?)", [(now-random.randint(0, DAY*14), i) for i in ids])
+	con.executemany("INSERT OR REPLACE INTO inactivity (bestowment_id, member) VALUES (?,?)", [(random.randint(1, len(ids)), i) for i in random.sample(ids, len(ids)//10)])
+	genealogy.rebuild(con)
+	return depth
+
+
+async def build(size, shape, path):
+	bot = Bot(True, path)
+	guild = fakediscord.Guild()
+	roles = {k: guild.add_role(k) for k in ['active','bestower','he','she','they']}
+	bot.client = fakediscord.Client([guild], user=fakediscord.Member(guild, "blitherbot", bot=True))
+	bot.config = SimpleNamespace(GUILD=guild.id, TAQ=0, EG=0, SPAM_CHANNELS=[], INVITE_DURATION=DAY*2)
+	bot.actions = ActionQueue(concurrency=64, rate=10**6, per=1.0)
+
+	members = [guild.add_member(random_name(), random_name(), [roles['active']] if random.random() < .9 else []) for i in range(size)]
+	depth = bot.db.run_sync(lambda con: populate(con, members, shape, bot.epoch()))
+	for m in random.sample(members[2:], size//50):
+		guild.remove_member(m.id)
+
+	bot.active_role = roles['active']
+	bot.bestower_role = roles['bestower']
+	bot.he_role, bot.she_role, bot.they_role = roles['he'], roles['she'], roles['they']
+	bot.most_recent_bestower = await bot.get_most_recent_bestower()
+	await bot.load_activity()
+	bot.index_roles()
+	bot.names = NameIndex(guild.members)
+
+	deepest = members[max(range(len(members)), key=lambda i: depth[i])]
+	return bot, guild, members, deepest
+
+
+def cases(bot, guild, members, deepest):
+	author = SimpleNamespace(author=members[0])
+	root = members[0].id
+	mstats = []
+
+	async def prepare_raffle():
+		mstats[:] = await bot.compile_member_stats()
+
+	async def restore_activity():
+		for m in guild.members:
+			if bot.active_role not in m.roles and random.random() < .9:
+				m.roles.append(bot.active_role)
+		bot.index_roles()
+
+	return {
+		'compile_member_stats': (None, lambda: bot.compile_member_stats()),
+		'build_raffle': (prepare_raffle, lambda: bot.build_raffle(mstats)),
+		'count_progeny_for': (None, lambda: bot.count_progeny_for(root)),
+		'print_progeny_for': (None, lambda: bot.print_progeny_for(root)),
+		'print_lineage': (None, lambda: bot.print_lineage(deepest.name, author)),
+		'select_target': (None, lambda: bot.select_target(deepest.name[:3], author)),
+		'select_target_miss': (None, lambda: bot.select_target("q"+deepest.name[1:]+"x", author)),
+		'check_for_inactivity': (restore_activity, lambda: bot.check_for_inactivity())
+	}
+
+
+async def call(fn):
+	result = fn()
+	if asyncio.iscoroutine(result):
+		result = await result
+	return result
+
+
+async def measure(bot, setup, fn, repeat):
+	times = []
+	for i in range(repeat):
+		bot.bump_data_version()
+		if setup:
+			await setup()
+		start = time.perf_counter()
+		await call(fn)
+		times.append(time.perf_counter()-start)
+
+	bot.bump_data_version()
+	if setup:
+		await setup()
+	tracemalloc.start()
+	await call(fn)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return statistics.median(times), peak
+
+
+async def run(sizes, shapes, repeat, only):
+	results = {}
+	for shape in shapes:
+		for size in sizes:
+			with tempfile.TemporaryDirectory() as d:
+				start = time.perf_counter()
+				bot, guild, members, deepest = await build(size, shape, os.path.join(d, "bench.db"))
+				print(f"\n{shape} tree, {size} members (built in {time.perf_counter()-start:.1f}s)")
+				try:
+					for name,(setup,fn) in cases(bot, guild, members, deepest).items():
+						if only and name not in only:
+							continue
+						elapsed, peak = await measure(bot, setup, fn, repeat)
+						results[f"{shape}/{size}/{name}"] = {'time': elapsed, 'peak': peak}
+						print(f"  {name:<22}{elapsed*1000:>10.2f} ms{peak/1024:>12.1f} KiB")
+				finally:
+					bot.db.close()
+	return results
+
+
+def compare(results, baseline, tolerance):
+	regressions = []
+	print("\ncompared to baseline:")
+	for key,r in results.items():
+		if key not in baseline:
+			continue
+		ratio = r['time']/baseline[key]['time'] if baseline[key]['time'] else 1
+		flag = ""
+		if ratio > 1+tolerance:
+			flag = "  REGRESSION"
+			regressions.append(key)
+		print(f"  {key:<45}{ratio:>8.2f}x{flag}")
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the bot's compute paths offline.")
+	parser.add_argument("--sizes", default="100,1000,10000", help="comma separated member counts, e.g. 100,1000,10000,100000")
+	parser.add_argument("--shapes", default="wide,deep", help="comma separated tree shapes: wide, deep")
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--only", default="", help="comma separated benchmark names")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--save", metavar="FILE", help="write results as a baseline")
+	parser.add_argument("--compare", metavar="FILE", help="compare against a saved baseline")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging a regression")
+	args = parser.parse_args()
+
+	random.seed(args.seed)
+	sizes = [int(s) for s in args.sizes.split(',')]
+	only = set(filter(None, args.only.split(',')))
+	results = asyncio.run(run(sizes, args.shapes.split(','), args.repeat, only))
+
+	if args.save:
+		with open(args.save, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		if compare(results, baseline, args.tolerance):
+			sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,7 +1,6 @@
 
 import discord
 import asyncio
-import sqlite3
 import string
 import random
 import traceback
@@ -9,17 +8,71 @@ import re
 import datetime
 import pprint
 import math
+import io
+import time
 
 from exceptions import FeedbackError
 from discord.ext import tasks
+import activity
 import bothelp
+import compute
+import genealogy
+import migrations
+import memberstats
+import posts
+import snapshots
+from raffle import Raffle
+from activity import ActivityLedger
+from deadlines import Deadlines
+from posts import PostLedger
+import logsink
+from logsink import LogSink
+from database import Database
+from nameindex import NameIndex
+from invites import InviteRegistry
+from actions import ActionQueue
+from cache import LRU
+from metrics import Metrics
+from profiler import Capture
+
+INACTIVE_AFTER = 60*60*24*7
+# links are released once they're more than two days old
+RELEASE_AFTER = 60*60*24*2+1
+RETRY_AFTER = 60
 
 
 class Bot():
-	def __init__(self, debug=True):
+	# client and metrics are passed in when several guilds share one connection
+	def __init__(self, debug=True, db_path="db.db", client=None, metrics=None):
 		self.debug = debug
 		self.confirming = None
 		self.do_bestow = True
+		self.activity = ActivityLedger()
+		self.activity_loaded = False
+		self.deadlines = Deadlines()
+		self.deadline_runner = None
+		self.posts = PostLedger()
+		self.posts_loaded = False
+		self.logs = LogSink(self.send_log)
+		self.snapshot = None
+		self.snapshot_loaded = False
+		self.active_ids = set()
+		self.bestower_ids = set()
+		self.names = NameIndex()
+		self.known_bestowees = set()
+		self.non_bestowees = set()
+		self.audit_dirty = True
+		self.resolving = asyncio.Lock()
+		self.resolved_joins = set()
+		self.invites = InviteRegistry()
+		self.actions = ActionQueue()
+		self.data_version = 0
+		self.stats_cache = None
+		self.stats_embeds = LRU(8)
+		self.subtrees = LRU(32)
+		self.progeny_pages = LRU(32)
+		self.metrics = metrics or Metrics()
+		self.capture = None
 
 		self.commands = [
 			("help", self.help),
@@ -31,45 +84,53 @@ class Bot():
 			("progeni", self.progeni),
 			("sex", self.sex_),
 			("test", self.test),
-			("troll", self.troll)
+			("troll", self.troll),
+			("perf", self.perf),
+			("profile", self.profile)
 		]
 		
-		self.setup_db()
-		self.setup_discord()
+		self.setup_db(db_path)
+		if client:
+			self.client = client
+		else:
+			self.setup_discord()
 
 	# SETUP
 
-	def setup_db(self):
-		con = self.db = sqlite3.connect("db.db")
-		schema = {
-			"messages (sent_at int, sent_by int unique)",
-			"bestowments (link text, bestower int, bestowee int, given_to_bestower_at int, bestowee_joined_at int, released_at int)",
-			"inactivity (bestowment_id int, member int unique)"
-		}
-
-		for t in schema:
-			try:
-				con.execute("CREATE TABLE IF NOT EXISTS "+t)
-			except Exception as e:
-				self.log("Error with SQL:\n"+t+"\n"+str(e))
-				break
-
-		con.commit()
+	def setup_db(self,path):
+		self.db = Database(path,metrics=self.metrics)
+		try:
+			version = self.db.run_sync(migrations.migrate)
+		except Exception as e:
+			self.log("Error migrating database:\n"+str(e))
+			raise
+		if version < len(migrations.MIGRATIONS):
+			self.log(f"migrated database from version {version} to {len(migrations.MIGRATIONS)}")
 
 	def setup_discord(self):
 		intents = discord.Intents.default()
 		intents.members = True
 		self.client = discord.Client(intents=intents)
+		self.metrics.instrument_http(self.client.http)
 
 	def start_bot(self,config):
 		self.config = config
-		self.client.run(self.config.TOKEN)
+		logsink.flush_before_close(self.client, [self.logs])
+		try:
+			self.client.run(self.config.TOKEN)
+		finally:
+			self.flush_activity().result()
+			self.db.close()
+			compute.shutdown()
 
 	# UTIL
 
 	def log(self, m):
 		print(m)
 
+	def setting(self, name, default=None):
+		return getattr(self.config, name, default)
+
 	def debug_log(self, m):
 		if self.debug:
 			self.log(m)
@@ -78,20 +139,67 @@ class Bot():
 		self.log(m)
 		if self.debug:
 			return
-		await self.public_log_channel.send(embed=discord.Embed(description=m))
+		await self.logs.put(self.public_log_channel,m)
 
 	async def private_log(self, m):
 		self.log(m)
 		if self.debug:
 			return
-		await self.private_log_channel.send(embed=discord.Embed(description=m))
+		await self.logs.put(self.private_log_channel,m)
 
+	# alerts skip the batching unless the same one just went out
 	async def private_alert(self, m):
 		self.log(m)
 		if self.debug:
 			return
+		if self.logs.repeated_alert(m):
+			await self.logs.put(self.private_log_channel,m)
+			return
+		# straight to discord, so an alert never queues behind the action queue
 		await self.private_log_channel.send(self.taq.mention,embed=discord.Embed(description=m))
 
+	async def send_log(self, channel, lines):
+		try:
+			for page in self.paginate(lines):
+				await self.send(channel,embed=discord.Embed(description=page))
+		except Exception as e:
+			self.log(traceback.format_exc())
+
+	@tasks.loop(seconds=5.0)
+	async def log_flusher(self):
+		await self.logs.flush()
+
+	def epoch(self,dt=None):
+		dt = dt or datetime.datetime.now(datetime.timezone.utc)
+		if dt.tzinfo is None:
+			dt = dt.replace(tzinfo=datetime.timezone.utc)
+		return int(dt.timestamp())
+
+	# anything that can change member stats or how they render bumps this
+	def bump_data_version(self):
+		self.data_version += 1
+
+	# pure-python work that can block the loop for a while goes through here, see COMPUTE_PROCESSES
+	async def offload(self,fn,*args):
+		with self.metrics.timer('compute_seconds',task=fn.__name__):
+			return await compute.run(self.setting('COMPUTE_PROCESSES'),fn,*args)
+
+	def paginate(self,lines,limit=4000):
+		pages = []
+		page = []
+		length = 0
+		for line in lines:
+			line = line[:limit]
+			if page and length+len(line) > limit:
+				pages.append('\n'.join(page))
+				page = []
+				length = 0
+			page.append(line)
+			length += len(line)+1
+		if page:
+			pages.append('\n'.join(page))
+		return pages
+
 	def nth(self,num):
 		last_char = str(num)[-1]
 		sec_last_char = str(num)[-2] if len(str(num)) > 1 else None
@@ -125,25 +233,19 @@ class Bot():
 
 	@property
 	def eligible_bestowers(self):
-		return [m for m in self.guild.members if not m.bot and self.active_role in m.roles and m.id != self.most_recent_bestower]
+		return [m for m in self.active_members if m.id != self.most_recent_bestower]
 
 	@property
 	def active_members(self):
-		return [m for m in self.guild.members if not m.bot and self.active_role in m.roles]
+		return [m for m in map(self.guild.get_member,self.active_ids) if m]
 
-	@property
-	def most_recent_bestower(self):
-		cur = self.db.execute("SELECT bestower FROM bestowments ORDER BY given_to_bestower_at DESC LIMIT 1")
-		mrb = [q[0] for q in cur.fetchall()]
-		mrb = mrb[0] if len(mrb) > 0 else None
-		return mrb
+	async def get_most_recent_bestower(self):
+		mrb = await self.db.fetchone("SELECT bestower FROM bestowments ORDER BY given_to_bestower_at DESC LIMIT 1")
+		return mrb[0] if mrb else None
 
-	@property
-	def active_bestowment(self):
-		cur = self.db.execute("SELECT rowid, bestowee FROM bestowments ORDER BY given_to_bestower_at DESC LIMIT 1")
-		ab = [[q[0],q[1]] for q in cur.fetchall()]
-		ab = ab[0][0] if len(ab) > 0 and not ab[0][1] else None
-		return ab
+	async def get_active_bestowment(self):
+		ab = await self.db.fetchone("SELECT rowid, bestowee FROM bestowments ORDER BY given_to_bestower_at DESC LIMIT 1")
+		return ab[0] if ab and not ab[1] else None
 
 	@property
 	def audit_count(self):
@@ -171,9 +273,34 @@ class Bot():
 		self.taq = self.guild.get_member(self.config.TAQ)
 		self.eg = self.guild.get_member(self.config.EG)
 
+		self.most_recent_bestower = await self.get_most_recent_bestower()
+		await self.load_activity()
+		await self.load_posts()
+		self.index_roles()
+		self.names = NameIndex(self.guild.members)
+		await self.sync_invites()
+		await self.schedule_deadlines()
+
+		if not self.log_flusher.is_running():
+			self.logs.limit = self.setting('LOG_BUFFER_LIMIT',500)
+			self.logs.policy = self.setting('LOG_FULL_POLICY','drop')
+			self.log_flusher.change_interval(seconds=self.setting('LOG_FLUSH_SECONDS',5))
+			self.log_flusher.start()
+
+		if not self.activity_flusher.is_running():
+			self.activity_flusher.change_interval(seconds=self.setting('ACTIVITY_FLUSH_SECONDS',10))
+			self.activity_flusher.start()
+
+		await self.metrics.start(self.setting('METRICS_PORT'))
+
 		if not self.debug:
 			await self.private_log("I'm back online! (v3.24)")
 			self.audit.start()
+			if not self.deadline_runner or self.deadline_runner.done():
+				self.deadline_runner = asyncio.create_task(self.deadlines.run(time.time,self.on_deadline))
+			if self.setting('PERF_DIGEST_MINUTES') and not self.perf_digest.is_running():
+				self.perf_digest.change_interval(minutes=self.config.PERF_DIGEST_MINUTES)
+				self.perf_digest.start()
 
 	async def on_message(self,m):
 		if m.author.bot:
@@ -184,8 +311,8 @@ class Bot():
 			if m.content != 'bot pass':
 				self.save_message(m)
 				
-				if self.active_role not in m.author.roles:
-					await m.author.add_roles(self.active_role)
+				if m.author.id not in self.active_ids:
+					await self.set_role(m.author,self.active_role,True)
 					await self.private_log("added active role to "+m.author.name)
 		except Exception as e:
 			await self.private_alert(traceback.format_exc())
@@ -208,8 +335,8 @@ class Bot():
 
 			if m.channel == self.sex_gifs_channel and has_gif:
 
-				last_theme_change = await self.sex_gifs_channel.history().get(author=self.client.user)
-				seconds_since_last_theme_change = (datetime.datetime.now() - last_theme_change.created_at).total_seconds()
+				last_theme_change = await self.last_post_at(self.sex_gifs_channel)
+				seconds_since_last_theme_change = self.epoch() - last_theme_change
 				chance_to_hit = math.floor( ((60*60*24*7) - seconds_since_last_theme_change) / (60*24*7*3) )
 				chance_to_hit = 1/chance_to_hit if chance_to_hit > 1 else 1
 				r = random.random()
@@ -226,18 +353,148 @@ class Bot():
 		if member.bot:
 			return
 
-		if self.active_bestowment:
+		self.update_role_index(member)
+		self.names.add(member)
+		self.audit_dirty = True
+
+		if await self.get_active_bestowment():
 			await self.resolve_active_bestowment(member)
 		else:
 			self.do_bestow = False
 			await self.private_alert("no active bestowment for "+member.name+"!")
 
+	async def on_member_update(self,before,after):
+		self.update_role_index(after)
+		if self.names.update(after):
+			self.bump_data_version()
+
+	async def on_user_update(self,before,after):
+		member = self.guild.get_member(after.id)
+		if member and self.names.update(member):
+			self.bump_data_version()
+
+	async def on_member_remove(self,member):
+		self.active_ids.discard(member.id)
+		self.bestower_ids.discard(member.id)
+		self.names.remove(member.id)
+		self.audit_dirty = True
+		self.bump_data_version()
+
+	async def on_invite_create(self,invite):
+		self.invites.add(invite)
+		self.audit_dirty = True
+
+	async def on_invite_delete(self,invite):
+		self.invites.remove(invite)
+		self.audit_dirty = True
+
+	# ROLES
+
+	def index_roles(self):
+		self.active_ids = {m.id for m in self.active_role.members if not m.bot}
+		self.bestower_ids = {m.id for m in self.bestower_role.members if not m.bot}
+
+	def role_index_for(self,role):
+		if role == self.active_role:
+			return self.active_ids
+		if role == self.bestower_role:
+			return self.bestower_ids
+		return None
+
+	def mark_role(self,member,role,has_role):
+		ids = self.role_index_for(role)
+		if ids is None or member.bot:
+			return
+		if has_role == (member.id in ids):
+			return
+		if has_role:
+			ids.add(member.id)
+			if role == self.active_role:
+				self.schedule_inactivity(member.id)
+		else:
+			ids.discard(member.id)
+		self.bump_data_version()
+
+	def update_role_index(self,member):
+		for role in [self.active_role,self.bestower_role]:
+			self.mark_role(member,role,role in member.roles)
+
+	# ACTIONS
+
+	async def set_role(self,member,role,has_role):
+		await self.actions.set_role(member,role,has_role)
+		self.mark_role(member,role,has_role)
+
+	async def send(self,channel,*args,**kwargs):
+		message = await self.actions.run(('channel',channel.id),lambda: channel.send(*args,**kwargs))
+		if message and channel.id in self.tracked_channels:
+			self.record_post(message)
+		return message
+
+	async def delete(self,message):
+		await self.actions.run(('channel',message.channel.id),message.delete)
+
+	# POSTS
+
+	async def load_posts(self):
+		if self.posts_loaded:
+			return
+		self.posts.seed(await self.db.run(posts.load,'load_posts'))
+		self.posts_loaded = True
+
+	# only the channels something reads the ledger for
+	@property
+	def tracked_channels(self):
+		return {self.config.BESTOWMENT_CHANNEL,self.config.SEX_GIFS_CHANNEL}
+
+	def record_post(self,message):
+		posted_at = self.epoch(message.created_at)
+		self.posts.add(message.channel.id,message.id,posted_at)
+		self.db.submit(lambda con: posts.save(con,message.channel.id,message.id,posted_at),'record_post')
+
+	# channels the ledger hasn't seen a post in yet fall back to one history scan
+	async def last_post_at(self,channel):
+		last = self.posts.last(channel.id)
+		if last:
+			return last[1]
+		message = await channel.history().get(author=self.client.user)
+		if not message:
+			return 0
+		self.record_post(message)
+		return self.epoch(message.created_at)
+
+	# deletes the bot's own posts in a channel by id instead of purging through its history
+	async def clear_posts(self,channel):
+		if not self.posts.known(channel.id):
+			await channel.purge(check=lambda m: m.author.bot)
+			return
+		sent = self.posts.posts(channel.id)
+		# bulk deletes only take messages under two weeks old
+		cutoff = self.epoch() - 60*60*24*13
+		recent = [i for i,posted_at in sent if posted_at > cutoff]
+		old = [i for i,posted_at in sent if posted_at <= cutoff]
+		for i in range(0,len(recent),100):
+			chunk = [discord.Object(id=j) for j in recent[i:i+100]]
+			try:
+				await self.actions.run(('channel',channel.id),lambda: channel.delete_messages(chunk))
+			except discord.HTTPException:
+				old += [j.id for j in chunk]
+		for i in old:
+			try:
+				await self.actions.run(('channel',channel.id),channel.get_partial_message(i).delete)
+			except discord.NotFound:
+				pass
+		ids = [i for i,posted_at in sent]
+		self.posts.remove(channel.id,set(ids))
+		await self.db.run(lambda con: posts.delete(con,channel.id,ids),'clear_posts')
+
 	# COMMANDS
 
 	async def parse_command(self,m):
 		for command,method in self.commands:
 			if m.content[4:].lower().startswith(command):
-				await method(m)
+				with self.metrics.timer('command_seconds',command=command):
+					await method(m)
 				return
 
 	async def help(self,m):
@@ -249,6 +506,10 @@ class Bot():
 		if m.channel.id not in self.config.SPAM_CHANNELS:
 			await m.reply(embed=discord.Embed(description="This command only works in designated spam channels."))
 			return
+		past = re.search(r"#(\d+)",arguments)
+		if past:
+			await self.print_past_stats(m,int(past[1]),arguments.replace(past[0],'').strip())
+			return
 		await self.print_member_stats(m,arguments)
 
 	async def skip(self,m):
@@ -256,10 +517,13 @@ class Bot():
 			await m.reply(embed=discord.Embed(description="Only the bestower can use this command."))
 			return
 		
-		invites = await self.lobby_channel.invites()
-		invites = [i for i in invites if i.inviter.id == self.client.user.id and not i.revoked]
-		for i in invites:
-			await i.delete()
+		for i in self.invites.active(self.client.user.id):
+			# the registry can be stale if a use or delete event was missed
+			try:
+				await self.actions.run(('invites',self.lobby_channel.id),i.delete)
+			except discord.NotFound:
+				pass
+			self.invites.remove(i)
 
 		they = self.pronoun_for(m.author)
 
@@ -279,13 +543,25 @@ class Bot():
 			await m.reply(embed=discord.Embed(description="Could not find that member."))
 			return
 
-		family_tree = self.print_progeny_for(target.id,showall=showall)
-		footer = ""
-		if family_tree == "":
-			family_tree = f"No progeny found for {target.mention}"
-		else:
-			footer = f"Showing progeny for {target.name}"
-		await m.reply(embed=discord.Embed(description=family_tree).set_footer(text=footer))
+		max_depth,max_breadth = self.setting('PROGENY_LIMITS',{}).get('progeni' if showall else 'progeny',(None,None))
+		family_tree = await self.print_progeny_for(target.id,showall,max_depth,max_breadth)
+		if not family_tree:
+			await m.reply(embed=discord.Embed(description=f"No progeny found for {target.mention}").set_footer(text=""))
+			return
+
+		footer = f"Showing progeny for {target.name}"
+		pages = self.paginate(family_tree)
+		if len(pages) > self.setting('PROGENY_MAX_PAGES',3):
+			tree = discord.File(io.BytesIO('\n'.join(family_tree).replace('`','').encode()),filename=f"progeny-{target.name}.txt")
+			await m.reply(footer,file=tree)
+			return
+
+		for i,page in enumerate(pages):
+			embed = discord.Embed(description=page).set_footer(text=footer if len(pages) < 2 else f"{footer} ({i+1}/{len(pages)})")
+			if i == 0:
+				await m.reply(embed=embed)
+			else:
+				await self.send(m.channel,embed=embed)
 
 	
 	async def liniage(self,m):
@@ -296,7 +572,7 @@ class Bot():
 		if m.channel.id not in self.config.SPAM_CHANNELS:
 			await m.reply(embed=discord.Embed(description="This command only works in designated spam channels."))
 			return
-		await m.reply(embed=discord.Embed(description=self.print_lineage(arguments,m,showall)))
+		await m.reply(embed=discord.Embed(description=await self.print_lineage(arguments,m,showall)))
 
 	async def sex_(self,m):
 		if not m.author.id in [self.taq.id,self.eg.id]:
@@ -311,110 +587,105 @@ class Bot():
 		await self.rename_sex_gifs()
 		await m.reply('done')
 
-	def print_lineage(self, arguments, m, showall=False):
+	async def perf(self,m):
+		if not m.author.id in [self.taq.id,self.eg.id]:
+			return
+		await m.reply(embed=discord.Embed(description=self.metrics.digest()))
+
+	# bot profile <audit|command> [runs]
+	async def profile(self,m):
+		if not m.author.id in [self.taq.id,self.eg.id]:
+			return
+		arguments = m.content[12:].lower().split()
+		name = arguments[0] if arguments else 'audit'
+		runs = int(arguments[1]) if len(arguments) > 1 and arguments[1].isdigit() else 1
+		if self.capture:
+			await m.reply(f"already profiling {self.capture.name}")
+			return
+		if name != 'audit' and name not in dict(self.commands):
+			await m.reply(f"no command called {name}")
+			return
+
+		# the wrapper only exists while armed, so profiling costs nothing when off
+		self.capture = Capture(name,runs,self.finish_profile)
+		if name == 'audit':
+			self.audit_tick = self.capture.wrap(self.audit_tick)
+		else:
+			self.commands = [(c,self.capture.wrap(f) if c == name else f) for c,f in self.commands]
+		await m.reply(f"profiling the next {runs} run{'s' if runs != 1 else ''} of {name}")
+
+	async def finish_profile(self,capture):
+		if capture.name == 'audit':
+			del self.audit_tick
+		else:
+			self.commands = [(c,getattr(f,'original',f)) for c,f in self.commands]
+		self.capture = None
+
+		summary = capture.summary()
+		self.log(summary)
+		if self.debug:
+			return
+		report = discord.File(io.BytesIO(summary.encode()),filename=f"profile-{capture.name}-{self.epoch()}.txt")
+		await self.send(self.private_log_channel,f"profile of {capture.name}, top functions by cumulative time",file=report)
+
+	async def print_lineage(self, arguments, m, showall=False):
 		target = self.select_target(arguments, m)
 		if not target:
 			return "Could not find that member."
-		parents = [target]
-		while True:
-			parent = self.get_parent_for(parents[-1])
-			if parent == None:
-				break
-			parents.append(parent)
-		parents.reverse()
-		return '\n-> '.join(f"#{self.get_invite_number_for(p)} {self.print_name_for(p.id,showall)}" for p in parents)
+		parents = await self.db.read(lambda con: genealogy.lineage(con, target.id),'lineage')
+		return '\n-> '.join(f"#{invite_number} {self.print_name_for(p,showall)}" for p,invite_number in parents)
 
 	def select_target(self, arguments, m):
-		arguments = arguments.lower()
 		if len(arguments) < 1:
-			target = m.author
-		else:
-			potential_targets = []
-			for m in self.guild.members:
-				if m.bot:
-					continue
-				if m.name.lower() == arguments:
-					potential_targets.append([m,'exact name'])
-				elif m.display_name.lower() == arguments:
-					potential_targets.append([m, 'exact display name'])
-				elif m.name.lower().startswith(arguments):
-					potential_targets.append([m,'name'])
-				elif m.display_name.lower().startswith(arguments):
-					potential_targets.append([m,'display_name'])
-
-			if len(potential_targets) < 1:
-				return None
-
-			if any(i[1] == 'exact name' for i in potential_targets):
-				target_type = 'exact name'
-			elif any(i[1] == 'exact display name' for i in potential_targets):
-				target_type = 'exact display name'
-			elif any(i[1] == 'name' for i in potential_targets):
-				target_type = 'name'
-			else:
-				target_type = 'display_name'
-
-			if target_type in ['name', 'exact name']:
-				potential_targets.sort(key=lambda x:len(x[0].name))
-			else:
-				potential_targets.sort(key=lambda x:len(x[0].display_name))
-
-			for t in potential_targets:
-				if t[1] == target_type:
-					target = t[0]
-					break
-		return target
-
-	def get_parent_for(self,member):
-		cur = self.db.execute("SELECT bestower FROM bestowments WHERE bestowee = ? AND bestower != bestowee",[member.id])
-		parent = [q[0] for q in cur.fetchall()]
-		parent_m = None
-		if parent:
-			parent_m = self.guild.get_member(parent[0])
-			if not parent_m:
-				class Parent:
-					def __init__(self,my_id):
-						self.id = my_id
-						self.mention = f"<@{my_id}>"
-				parent_m = Parent(parent[0])
-
-		return parent_m
-
-	def get_invite_number_for(self,member):
-		cur = self.db.execute("SELECT rowid FROM bestowments WHERE bestowee = ? AND bestower != bestowee",[member.id])
-		inv_num = [q[0] for q in cur.fetchall()]
-		return inv_num[0] if inv_num else 0
+			return m.author
+		target = self.names.best(arguments)
+		return self.guild.get_member(target) if target else None
 
 	# SAVING
 
 	def save_message(self,m):
-		cursor = self.db.cursor()
-		sent_by = m.author.id
-		sent_at = m.created_at
-		cursor.execute("INSERT OR REPLACE INTO messages (sent_at, sent_by) VALUES (?,?)",[sent_at, sent_by])
-		self.db.commit()
-		cursor.close()
+		self.activity.record(m.author.id,self.epoch(m.created_at))
+		if len(self.activity) >= self.setting('ACTIVITY_FLUSH_SIZE',100):
+			self.flush_activity()
 
-	# ACTIVITY
+	def flush_activity(self):
+		seen,counts = self.activity.drain()
+		return self.db.submit(lambda con: activity.save(con,seen,counts),'flush_activity')
 
-	async def check_for_inactivity(self):
-		one_week_ago = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=7)).strftime("%Y-%m-%d %H:%M:%S.%f")
-		m_ids = [m.id for m in self.active_members]
-		cur = self.db.execute("SELECT sent_by, sent_at FROM messages")
-		members = [(q[0],q[1]) for q in cur.fetchall() if q[0] in m_ids]
-		cur.close()
+	# the ledger is the live copy of activity, so the database is only read once
+	async def load_activity(self):
+		if self.activity_loaded:
+			return
+		days = self.setting('ACTIVITY_DAYS',28)
+		now = self.epoch()
+		seen,counts = await self.db.read(lambda con: activity.load(con,days,now),'load_activity')
+		if not self.activity.buckets:
+			self.activity = ActivityLedger(days)
+		self.activity.seed(seen,counts)
+		self.activity_loaded = True
+
+	@tasks.loop(seconds=10.0)
+	async def activity_flusher(self):
+		await asyncio.wrap_future(self.flush_activity())
 
-		for i in members:
-			if i[1] > one_week_ago:
-				continue
+	# ACTIVITY
 
-			m = self.guild.get_member(i[0])
-			if m:
-				await m.remove_roles(self.active_role)
-				cursor = self.db.cursor()
-				cursor.execute("INSERT OR REPLACE INTO inactivity (bestowment_id, member) VALUES (?,?)",[self.active_bestowment, m.id])
-				self.db.commit()
-				cursor.close()
+	# sweeps every active member, or just the given ids when a deadline fires
+	async def check_for_inactivity(self,ids=None):
+		one_week_ago = self.epoch() - INACTIVE_AFTER
+		ids = self.active_ids if ids is None else [i for i in ids if i in self.active_ids]
+		members = self.activity.inactive_since(ids,one_week_ago)
+		active_bestowment = await self.get_active_bestowment()
+
+		stale = [m for m in map(self.guild.get_member,members) if m]
+		results = await asyncio.gather(*[self.set_role(m,self.active_role,False) for m in stale],return_exceptions=True)
+		removed = [m for m,r in zip(stale,results) if not isinstance(r,Exception)]
+		if removed:
+			await self.db.executemany("INSERT OR REPLACE INTO inactivity (bestowment_id, member) VALUES (?,?)",[(active_bestowment, m.id) for m in removed])
+			self.bump_data_version()
+		for r in results:
+			if isinstance(r,Exception):
+				raise r
 
 	# BESTOWMENT
 
@@ -425,27 +696,37 @@ class Bot():
 
 		await self.check_for_inactivity()
 
-		for m in self.bestower_role.members[:]:
-			await m.remove_roles(self.bestower_role)
+		bestowers = [self.guild.get_member(i) for i in self.bestower_ids]
+		self.bestower_ids.clear()
+		await asyncio.gather(*[self.set_role(m,self.bestower_role,False) for m in bestowers if m])
 
 		if len(self.eligible_bestowers) < 1:
 			await self.private_alert("no eligible bestowers!")
 			return
 
-		mstats = self.compile_member_stats()
-		bestower = self.draw_from_raffle()
-		await bestower.add_roles(self.bestower_role)
+		mstats = await self.compile_member_stats()
+		bestower = await self.draw_from_raffle(mstats)
+		await self.set_role(bestower,self.bestower_role,True)
 
 		invite = await self.lobby_channel.create_invite(max_age=self.config.INVITE_DURATION,max_uses=1)
-
-		await self.bestowment_channel.purge(check=lambda m: m.author.bot)
-		await self.bestowment_channel.send(bestower.mention,embed=discord.Embed(description=str(invite)+"\n\nBehold! This is the only invite link in the server, good for exactly one use.\n\nYou may share it with whomever you like or say `bot pass` to hand the duty of bestowment off to someone else.\n\nYou have two days.\n").set_footer(icon_url=random.choice(self.guild.emojis).url,text="The internet is counting on you"))
-
-		cursor = self.db.cursor()
-		cursor.execute("INSERT INTO bestowments(link, bestower, given_to_bestower_at) VALUES(?,?,?)",[invite.url,bestower.id,invite.created_at])
-		invite_number = str(cursor.lastrowid)
-		self.db.commit()
-		cursor.close()
+		self.invites.add(invite)
+
+		await self.clear_posts(self.bestowment_channel)
+		await self.send(self.bestowment_channel,bestower.mention,embed=discord.Embed(description=str(invite)+"\n\nBehold! This is the only invite link in the server, good for exactly one use.\n\nYou may share it with whomever you like or say `bot pass` to hand the duty of bestowment off to someone else.\n\nYou have two days.\n").set_footer(icon_url=random.choice(self.guild.emojis).url,text="The internet is counting on you"))
+
+		# the odds this draw used are snapshotted in the same transaction as the bestowment
+		given_at = self.epoch(invite.created_at)
+		previous = await self.last_snapshot()
+		ceiling,current = snapshots.bases(mstats)
+		def insert(con):
+			rowid = con.execute("INSERT INTO bestowments(link, bestower, given_to_bestower_at) VALUES(?,?,?)",[invite.url,bestower.id,given_at]).lastrowid
+			return rowid,snapshots.save(con,rowid,ceiling,current,previous)
+		rowid,keyframe = await self.db.run(insert,'insert bestowments')
+		self.snapshot = (rowid,keyframe,current)
+		invite_number = str(rowid)
+		self.deadlines.schedule(('release',int(invite_number)),given_at+RELEASE_AFTER)
+		self.most_recent_bestower = bestower.id
+		self.bump_data_version()
 
 		mstats.sort(key=lambda m: m['chance'],reverse=True)
 		bstats = [m for m in mstats if m['m'].id == bestower.id][0]
@@ -464,44 +745,70 @@ class Bot():
 		await self.public_log(msg)
 		self.do_bestow = True
 
+	# joins and audit ticks can both spot the same join, only the first one through resolves it
+	# keyed by join time so a former bestowee rejoining through a later link still resolves it
 	async def resolve_active_bestowment(self, member):
-		cursor = self.db.execute("SELECT bestower FROM bestowments WHERE rowid = ?",[self.active_bestowment])
-		b_id = cursor.fetchall()[0][0]
-		cursor.close()
-		bestower = self.guild.get_member(b_id) or None
-		they = self.pronoun_for(bestower) if bestower else "they"
-
-		cursor = self.db.cursor()
-		cursor.execute("UPDATE bestowments SET bestowee = ?, bestowee_joined_at = ? WHERE rowid = ?", [member.id,member.joined_at,self.active_bestowment])
-		self.db.commit()
-		cursor.close()
+		join = (member.id,self.epoch(member.joined_at))
+		async with self.resolving:
+			active_bestowment = await self.get_active_bestowment()
+			if not active_bestowment or join in self.resolved_joins:
+				return
+			b_id = (await self.db.fetchone("SELECT bestower FROM bestowments WHERE rowid = ?",[active_bestowment]))[0]
+			bestower = self.guild.get_member(b_id) or None
+			they = self.pronoun_for(bestower) if bestower else "they"
+
+			def resolve(con):
+				if not con.execute("UPDATE bestowments SET bestowee = ?, bestowee_joined_at = ? WHERE rowid = ? AND bestowee IS NULL", [member.id,self.epoch(member.joined_at),active_bestowment]).rowcount:
+					return False
+				genealogy.record(con, b_id, member.id)
+				return True
+			if not await self.db.run(resolve,'resolve'):
+				return
+			self.resolved_joins.add(join)
+			self.known_bestowees.add(member.id)
+			self.audit_dirty = True
+			self.bump_data_version()
 
 		await self.public_log(f"...and {they} chose {member.mention}! Welcome!")
 		await self.bestow()
 
+	async def reconcile_members(self,full=False):
+		if full:
+			self.known_bestowees = {q[0] for q in await self.db.fetchall("SELECT bestowee FROM bestowments WHERE bestowee IS NOT NULL")}
+		exempt = {self.config.TAQ,self.config.EG}
+		self.non_bestowees = {m.id for m in self.guild.members if not m.bot and m.id not in exempt and m.id not in self.known_bestowees}
+		self.audit_dirty = False
+
+	async def sync_invites(self):
+		self.invites = InviteRegistry(self.lobby_channel.id)
+		self.invites.seed(await self.lobby_channel.invites())
+
 	def stop_auditing(self):
 		self.audit.cancel()
+		if self.deadline_runner:
+			self.deadline_runner.cancel()
 
 	@tasks.loop(seconds=60.0)
 	async def audit(self):
+		with self.metrics.timer('audit_seconds'):
+			await self.audit_tick()
+
+	async def audit_tick(self):
 		if not self.do_bestow:
 			return
 
 		count = self.audit_count
 
-		await self.check_for_inactivity()
-
-		cursor = self.db.execute("SELECT bestowee FROM bestowments")
-		members = [q[0] for q in cursor.fetchall()]
-		cursor.close()
-
-		non_bestowees = []
+		# membership only needs rescanning after joins, leaves and invite changes
+		if count % self.setting('AUDIT_FULL_EVERY',60) == 0:
+			await self.reconcile_members(full=True)
+		elif self.audit_dirty:
+			await self.reconcile_members()
 
-		for m in self.guild.members:
-			if m.id not in [self.config.TAQ,self.config.EG] and m.id not in members and not m.bot:
-				non_bestowees.append(m)
+		active_bestowment = await self.get_active_bestowment()
+		non_bestowees = [m for m in map(self.guild.get_member,self.non_bestowees) if m]
 
-		if len(non_bestowees) == 1 and self.active_bestowment:
+		if len(non_bestowees) == 1 and active_bestowment:
 			await self.resolve_active_bestowment(non_bestowees[0])
 
 		elif len(non_bestowees) == 1:
@@ -513,76 +820,146 @@ class Bot():
 			await self.private_alert("Audit found more than one new member!")
 
 		else:
-			invites = await self.lobby_channel.invites()
-			invites = [i for i in invites if i.inviter.id == self.client.user.id and not i.revoked]
+			if count % self.setting('INVITE_VERIFY_EVERY',30) == 0:
+				await self.sync_invites()
+			invites = self.invites.active(self.client.user.id)
 			if len(invites) < 1:
 				await self.bestow()
 
-			elif self.active_bestowment:
-				cursor = self.db.execute("SELECT given_to_bestower_at,link,released_at FROM bestowments WHERE rowid = ?",[self.active_bestowment])
-				bestowment_time,link,released_at = cursor.fetchall()[0]
-				cursor.close()
-				if not released_at:
+	# DEADLINES
+
+	# inactivity expiry and link release fire from the deadline heap instead of being rechecked every audit
+	async def schedule_deadlines(self):
+		for member_id in self.active_ids:
+			self.schedule_inactivity(member_id)
+		active_bestowment = await self.get_active_bestowment()
+		row = await self.db.fetchone("SELECT given_to_bestower_at FROM bestowments WHERE rowid = ? AND released_at IS NULL",[active_bestowment])
+		if row:
+			self.deadlines.schedule(('release',active_bestowment),row[0]+RELEASE_AFTER)
+
+	def schedule_inactivity(self,member_id):
+		last_seen = self.activity.last_seen.get(member_id)
+		if last_seen:
+			self.deadlines.schedule(('inactive',member_id),last_seen+INACTIVE_AFTER)
+
+	# anything that fails is tried again a minute later instead of waiting for the next bestow or restart
+	async def on_deadline(self,keys):
+		# anyone who spoke since their deadline was set just gets a later one
+		cutoff = self.epoch() - INACTIVE_AFTER
+		members = [key[1] for key in keys if key[0] == 'inactive']
+		for member_id in members:
+			if member_id in self.active_ids and self.activity.last_seen.get(member_id,0) > cutoff:
+				self.schedule_inactivity(member_id)
+		try:
+			if members:
+				await self.check_for_inactivity(members)
+		except Exception as e:
+			for member_id in members:
+				if member_id in self.active_ids and ('inactive',member_id) not in self.deadlines.due:
+					self.deadlines.schedule(('inactive',member_id),time.time()+RETRY_AFTER)
+			await self.private_alert(traceback.format_exc())
+
+		for kind,rowid in keys:
+			if kind != 'release':
+				continue
+			try:
+				await self.release_link(rowid)
+			except Exception as e:
+				self.deadlines.schedule(('release',rowid),time.time()+RETRY_AFTER)
+				await self.private_alert(traceback.format_exc())
 
-					two_days_ago = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=2)).strftime("%Y-%m-%d %H:%M:%S.%f")
+	async def release_link(self,rowid):
+		# mid-bestowment, so look again once it has settled
+		if not self.do_bestow:
+			self.deadlines.schedule(('release',rowid),time.time()+RETRY_AFTER)
+			return
+		if rowid != await self.get_active_bestowment() or not self.invites.active(self.client.user.id):
+			return
+		link,released_at = await self.db.fetchone("SELECT link,released_at FROM bestowments WHERE rowid = ?",[rowid])
+		if not released_at:
+			await self.public_log(f"||{link}||")
+			await self.db.execute("UPDATE bestowments SET released_at = ? WHERE rowid = ?",[self.epoch(),rowid])
 
-					if bestowment_time < two_days_ago:
-						await self.public_log(f"||{link}||")
-						cursor = self.db.cursor()
-						cursor.execute("UPDATE bestowments SET released_at = ? WHERE rowid = ?",[datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f"),self.active_bestowment])
-						self.db.commit()
-						cursor.close()
+	# METRICS
 
-	def draw_from_raffle(self):
-		return random.choice(self.build_raffle())
+	@tasks.loop(minutes=60.0)
+	async def perf_digest(self):
+		if self.perf_digest.current_loop == 0:
+			return
+		await self.private_log(self.metrics.digest())
 
-	def build_raffle(self):
-		mstats = self.compile_member_stats()
-		raffle = []
-		for m in mstats:
+	async def draw_from_raffle(self,mstats=None):
+		return (await self.build_raffle(mstats)).draw()['m']
 
-			if max([i['touch'] for i in mstats]) == 41 and m['id'] != 466466163757678592:
-				continue
+	async def build_raffle(self,mstats=None):
+		mstats = mstats or await self.compile_member_stats()
+		forced = self.setting('RAFFLE_OVERRIDES',{}).get(max(m['touch'] for m in mstats))
+		constraint = (lambda m: m['id'] == forced) if forced else None
+		return Raffle(mstats, [m['tickets'] for m in mstats], constraint)
 
-			for t in range(m['tickets']):
-				raffle.append(m['m'])
-		return raffle
-
-	def compile_member_stats(self):
-		members = self.eligible_bestowers
-		member_stats = []
-		for m in members:
-			cursor = self.db.execute("SELECT rowid FROM bestowments WHERE bestower = ? OR bestowee = ? ORDER BY given_to_bestower_at DESC LIMIT 1", [m.id, m.id])
-			touch = cursor.fetchall()[0][0]
-			cursor = self.db.execute("SELECT bestowment_id FROM inactivity WHERE member = ? ORDER BY bestowment_id DESC LIMIT 1",[m.id])
-			last_inactive = cursor.fetchall()
-			last_inactive = last_inactive[0][0] if len(last_inactive) > 0 else None
-			cursor = self.db.execute("SELECT rowid FROM bestowments WHERE bestowee = ? ORDER BY given_to_bestower_at DESC LIMIT 1", [m.id])
-			invite_number = cursor.fetchall()
-			invite_number = invite_number[0][0] if len(invite_number) > 0 else 0
-			effective_touch = last_inactive if last_inactive and last_inactive > touch else touch
-			cursor = self.db.execute("SELECT COUNT(rowid) FROM bestowments WHERE bestower = ?",[m.id])
-			bestowments = cursor.fetchall()[0][0]
-			cursor.close()
-			children = self.count_progeny_for(m.id)
-			member_stats.append({'name':m.name,'id':m.id,'touch':touch,'effective_touch':effective_touch,'bestowments':bestowments,'children':children,'inactive':last_inactive,'m':m, 'invite_number':invite_number})
-
-		max_touch = max([m['touch'] for m in member_stats])
-		max_bestowments = max([m['bestowments'] for m in member_stats])
-		max_children = max([m['children'] for m in member_stats])
+	async def compile_member_stats(self):
+		version = self.data_version
+		if self.stats_cache and self.stats_cache[0] == version:
+			return list(self.stats_cache[1])
 
+		members = {m.id: m for m in self.eligible_bestowers}
+		member_stats = await self.offload(memberstats.compile,list(members),await self.db.read(memberstats.load,'member_stats'))
 		for m in member_stats:
-			m['tickets'] = max_touch+max_bestowments+max_children-m['effective_touch']-m['bestowments']-m['children']
-		total_tickets = sum([m['tickets'] for m in member_stats])
-		for m in member_stats:
-			m['chance'] = m['tickets']/total_tickets
+			m['m'] = members[m['id']]
+			m['name'] = m['m'].name
 
-		return member_stats
+		if version == self.data_version:
+			self.stats_cache = (version, member_stats)
+		return list(member_stats)
 
 	async def print_member_stats(self,op,size='l'):
+		key = (self.data_version,size)
+		embed = self.stats_embeds.get(key)
+		if not embed:
+			embed = await self.render_member_stats(size)
+			if key[0] == self.data_version:
+				self.stats_embeds.put(key,embed)
+		await op.reply(embed=embed, mention_author=False)
+
+	async def last_snapshot(self):
+		if not self.snapshot_loaded:
+			self.snapshot = await self.db.read(snapshots.latest,'raffle_snapshot')
+			self.snapshot_loaded = True
+		return self.snapshot
+
+	async def print_past_stats(self,op,invite_number,size='l'):
+		key = (self.data_version,invite_number,size)
+		embed = self.stats_embeds.get(key)
+		if not embed:
+			snapshot = await self.db.read(lambda con: snapshots.load(con,invite_number),'raffle_snapshot')
+			if snapshot:
+				embed = self.render_past_stats(invite_number,snapshot[0],snapshot[2],size)
+			else:
+				embed = discord.Embed(description=f"No raffle odds were saved for invite #{invite_number}.")
+			self.stats_embeds.put(key,embed)
+		await op.reply(embed=embed, mention_author=False)
+
+	def render_past_stats(self,invite_number,ceiling,bases,size='l'):
+		odds = snapshots.odds(ceiling,bases)
+		msg = []
+		length = 0
+		for member_id,tickets,chance in odds:
+			if size == 'xs':
+				more = "**"+self.print_name_for(member_id,True)+'**: '+str(round(chance*100,2))+'%'
+			else:
+				more = "**"+self.print_name_for(member_id,True)+"**\n"+str(tickets)+" tickets / "+str(round(chance*100,2))+"% chance\n"
+			if length+len(more) >= 3000:
+				break
+			msg.append(more)
+			length += len(more)
+		shown = "showing all "+str(len(msg)) if len(msg) == len(odds) else "showing top "+str(len(msg))+" of "+str(len(odds))
+		description = f"odds for invite #{invite_number}\ntotal tickets: {sum(t for i,t,c in odds)}\n\n"+'\n'.join(msg)
+		return discord.Embed(description=description).set_footer(text=shown)
+
+	async def render_member_stats(self,size='l'):
 		msg = []
 		footer = ""
-		stats = self.compile_member_stats()
+		stats = await self.compile_member_stats()
 		stats.sort(key=lambda m:m['chance'],reverse=True)
 		count = 0
 		for member in stats:
@@ -643,44 +1020,46 @@ class Bot():
 		for f in fields:
 			embed.add_field(name=" ",value='\n'.join(f))
 
-		await op.reply(embed=embed, mention_author=False)
-		return
+		return embed
+
+	async def count_progeny_for(self,member_id):
+		return await self.db.read(lambda con: genealogy.count_descendants(con, member_id),'count_descendants')
+
+	async def print_progeny_for(self,member_id,showall=False,max_depth=None,max_breadth=None):
+		key = (self.data_version,member_id,showall,max_depth,max_breadth)
+		lines = self.progeny_pages.get(key)
+		if lines is None:
+			children = await self.get_subtree(member_id)
+			lines = await self.offload(genealogy.render_progeny,member_id,children,self.member_snapshot(member_id,children),showall,max_depth,max_breadth)
+			self.progeny_pages.put(key,lines)
+		return lines
+
+	# any cached subtree that reaches member_id already holds everything below it
+	async def get_subtree(self,member_id):
+		version = self.data_version
+		for v,children in self.subtrees.values():
+			if v == version and member_id in children:
+				return children
+		children = await self.db.read(lambda con: genealogy.subtree(con, member_id),'subtree')
+		self.subtrees.put(member_id,(version,children))
+		return children
 
-	def count_progeny_for(self,member_id):
-		progeny = 0
-		for c in self.get_children_for(member_id):
-			progeny += 1
-			progeny += self.count_progeny_for(c[1])
-		return progeny
-
-	def print_progeny_for(self,member_id,indents=-1,showall=False):
-		progeny = ""
-		indents += 1
-		for c in self.get_children_for(member_id):
-			for k,i in enumerate(range(indents)):
-				if k == indents-1:
-					progeny += '`  `'
-				else:
-					progeny += '`  ` '
-			progeny += f"#{c[0]} {self.print_name_for(c[1],showall)}\n"
-			progeny += self.print_progeny_for(c[1],indents,showall)
-		return progeny
+	# {id: (name, active)} for just the members under member_id, plain data a worker process can render from
+	def member_snapshot(self,member_id,children):
+		members = {}
+		stack = [member_id]
+		while stack:
+			for invite_number,child in children.get(stack.pop(),[]):
+				stack.append(child)
+				member = self.guild.get_member(child)
+				if member:
+					members[child] = (member.name,self.active_role in member.roles)
+		return members
 
 	def print_name_for(self,member_id,showall=False):
-		name = f"<@{member_id}>"
 		member = self.guild.get_member(member_id)
-		if member and (self.active_role not in member.roles or showall):
-			name = member.name
-		if not member:
-			name = "~~"+name+"~~"
-		return name
-
+		return genealogy.display_name(member_id,(member.name,self.active_role in member.roles) if member else None,showall)
 
-	def get_children_for(self,member_id):
-		cursor = self.db.execute("SELECT rowid,bestowee FROM bestowments WHERE bestowee IS NOT NULL AND bestower = ? AND bestower != bestowee",[member_id])
-		children = [c for c in cursor.fetchall()]
-		cursor.close()
-		return children
 
 	async def rename_sex_gifs(self,name=None):
 		if not name:
@@ -690,7 +1069,7 @@ class Bot():
 		else:
 			word = name
 		await self.sex_gifs_channel.edit(name=f"sex {word}")
-		await self.sex_gifs_channel.send(embed=discord.Embed(description=f"NEW THEME: {word.upper()}",colour=random.randrange(255)*random.randrange(255)*random.randrange(255)))
+		await self.send(self.sex_gifs_channel,embed=discord.Embed(description=f"NEW THEME: {word.upper()}",colour=random.randrange(255)*random.randrange(255)*random.randrange(255)))
 
 	async def troll(self, m):
 		if not m.author.id in [self.taq.id,self.eg.id]:
@@ -701,17 +1080,17 @@ class Bot():
 			channel_id = int(arguments[0])
 		except ValueError:
 			await m.reply("invalid channel id")
-			await m.delete()
+			await self.delete(m)
 			return
 
 		target_channel = discord.utils.get(self.guild.channels, id=channel_id)
 
 		if not target_channel:
 			await m.reply("channel not found")
-			await m.delete()
+			await self.delete(m)
 			return
 
 		content = ' '.join(arguments[1:])
-		await target_channel.send(content)
-		await m.delete()
+		await self.send(target_channel,content)
+		await self.delete(m)
 		return
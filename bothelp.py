@@ -3,6 +3,7 @@ default = """`bot help`: shows this prompt
 `bot stats`: print internet member stats
 `bot stats s`: print a more compact list of member stats
 `bot stats xs`: print a tiny list of member stats
+`bot stats #[number]`: print everyone's odds when that invite was drawn
 
 `bot lineage [name]`: print the lineage of the named member
 `bot liniage [name]`: as lineage but w/o mentions
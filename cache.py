@@ -0,0 +1,32 @@
+from collections import OrderedDict
+
+
+# small least-recently-used map
+class LRU():
+	def __init__(self, size=16):
+		self.size = size
+		self.items = OrderedDict()
+
+	def __len__(self):
+		return len(self.items)
+
+	def __contains__(self, key):
+		return key in self.items
+
+	def get(self, key, default=None):
+		if key not in self.items:
+			return default
+		self.items.move_to_end(key)
+		return self.items[key]
+
+	def put(self, key, value):
+		self.items[key] = value
+		self.items.move_to_end(key)
+		while len(self.items) > self.size:
+			self.items.popitem(last=False)
+
+	def values(self):
+		return list(self.items.values())
+
+	def clear(self):
+		self.items.clear()
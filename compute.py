@@ -0,0 +1,23 @@
+import asyncio
+import concurrent.futures
+
+# one worker pool per process, shared by every guild's bot
+pool = None
+
+
+# runs fn(*args) in a worker process when processes > 0, otherwise inline on the loop
+# fn has to be a module level function and args plain data, since both get pickled
+async def run(processes, fn, *args):
+	global pool
+	if not processes:
+		return fn(*args)
+	if pool is None:
+		pool = concurrent.futures.ProcessPoolExecutor(processes)
+	return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+def shutdown():
+	global pool
+	if pool:
+		pool.shutdown(wait=False, cancel_futures=True)
+		pool = None
@@ -24,7 +24,43 @@ class C:
 
 		self.INVITE_DURATION = 0
 
+		self.ACTIVITY_FLUSH_SECONDS = 10
+		self.ACTIVITY_FLUSH_SIZE = 100
+		# days of per-member message counts kept in memory
+		self.ACTIVITY_DAYS = 28
+		self.AUDIT_FULL_EVERY = 60
+		self.INVITE_VERIFY_EVERY = 30
+
+		# log lines are batched into as few embeds as possible every LOG_FLUSH_SECONDS
+		# when a log channel has LOG_BUFFER_LIMIT lines waiting, 'drop' discards new ones and 'wait' holds the caller
+		self.LOG_FLUSH_SECONDS = 5
+		self.LOG_BUFFER_LIMIT = 500
+		self.LOG_FULL_POLICY = 'drop'
+
+		# command: (max depth, max breadth), None for no limit
+		self.PROGENY_LIMITS = {
+			'progeny': (None, None),
+			'progeni': (None, None)
+		}
+		self.PROGENY_MAX_PAGES = 3
+
+		# worker processes for stats and progeny rendering, 0 to run them on the event loop
+		self.COMPUTE_PROCESSES = 0
+
+		# last invite #: member id that must bestow the next one
+		self.RAFFLE_OVERRIDES = {}
+
+		# localhost port for prometheus text metrics, None to disable
+		self.METRICS_PORT = None
+		# minutes between perf digests in the private log, None to disable
+		self.PERF_DIGEST_MINUTES = 60
+
 		self.TAQ = 0
 		self.EG = 0
 
+		# more guilds to run on the same token: guild id -> settings that differ from the ones above
+		# e.g. {0: {'ACTIVE_ROLE': 0, 'BESTOWER_ROLE': 0, 'LOBBY_CHANNEL': 0, ..., 'DB_PATH': 'db-0.db'}}
+		# each guild gets its own database, db-<guild id>.db unless DB_PATH is set
+		self.GUILDS = {}
+
 config = C()
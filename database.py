@@ -0,0 +1,110 @@
+import asyncio
+import concurrent.futures
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+from metrics import statement
+
+
+# sqlite access that stays off the event loop:
+# writes go through one writer thread in submission order, each job in its own transaction,
+# reads run on a small pool of read-only connections via run_in_executor
+class Database():
+	def __init__(self, path, readers=2, metrics=None):
+		self.path = path
+		self.metrics = metrics
+		self.uri = "file:"+urllib.parse.quote(os.path.abspath(path))+"?mode=ro"
+		self.local = threading.local()
+		self.writes = queue.Queue()
+		self.commits = 0
+		self.readers = concurrent.futures.ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+		ready = concurrent.futures.Future()
+		self.writer = threading.Thread(target=self.write_loop, args=(ready,), name="db-writer", daemon=True)
+		self.writer.start()
+		ready.result()
+
+	def write_loop(self, ready):
+		try:
+			con = sqlite3.connect(self.path)
+			con.execute("PRAGMA journal_mode=WAL")
+			con.execute("PRAGMA synchronous=NORMAL")
+		except Exception as e:
+			ready.set_exception(e)
+			return
+		ready.set_result(True)
+
+		while True:
+			job = self.writes.get()
+			if job is None:
+				break
+			fn, label, future = job
+			if not future.set_running_or_notify_cancel():
+				continue
+			start = time.perf_counter()
+			try:
+				with con:
+					result = fn(con)
+			except BaseException as e:
+				future.set_exception(e)
+			else:
+				self.commits += 1
+				future.set_result(result)
+			if self.metrics:
+				self.metrics.observe('db_write_seconds', time.perf_counter()-start, statement=label)
+
+		con.close()
+
+	def reader(self):
+		if not hasattr(self.local, 'con'):
+			self.local.con = sqlite3.connect(self.uri, uri=True)
+		return self.local.con
+
+	# WRITES
+
+	def submit(self, fn, label=None):
+		future = concurrent.futures.Future()
+		self.writes.put((fn, label or fn.__name__, future))
+		return future
+
+	def run_sync(self, fn, label=None):
+		return self.submit(fn, label).result()
+
+	async def run(self, fn, label=None):
+		return await asyncio.wrap_future(self.submit(fn, label))
+
+	async def execute(self, sql, params=()):
+		return await self.run(lambda con: con.execute(sql, params).lastrowid, statement(sql))
+
+	async def executemany(self, sql, rows):
+		return await self.run(lambda con: con.executemany(sql, rows).rowcount, statement(sql))
+
+	# READS
+
+	async def read(self, fn, label=None):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.readers, self.timed_read, fn, label or fn.__name__)
+
+	def timed_read(self, fn, label):
+		start = time.perf_counter()
+		try:
+			return fn(self.reader())
+		finally:
+			if self.metrics:
+				self.metrics.observe('db_read_seconds', time.perf_counter()-start, statement=label)
+
+	async def fetchall(self, sql, params=()):
+		return await self.read(lambda con: con.execute(sql, params).fetchall(), statement(sql))
+
+	async def fetchone(self, sql, params=()):
+		rows = await self.fetchall(sql, params)
+		return rows[0] if rows else None
+
+	def close(self):
+		self.writes.put(None)
+		self.writer.join()
+		self.readers.shutdown()
@@ -0,0 +1,51 @@
+import asyncio
+import heapq
+
+
+# keys that each fire once at an epoch time; scheduling a key again moves its deadline
+# moved and cancelled entries stay in the heap and are skipped when they surface
+class Deadlines():
+	def __init__(self):
+		self.heap = []
+		self.due = {}
+		self.changed = asyncio.Event()
+
+	def __len__(self):
+		return len(self.due)
+
+	def schedule(self, key, at):
+		self.due[key] = at
+		heapq.heappush(self.heap, (at, key))
+		if self.heap[0] == (at, key):
+			self.changed.set()
+
+	def cancel(self, key):
+		self.due.pop(key, None)
+
+	def next_at(self):
+		while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+			heapq.heappop(self.heap)
+		return self.heap[0][0] if self.heap else None
+
+	def pop_due(self, now):
+		fired = []
+		while self.heap and self.heap[0][0] <= now:
+			at, key = heapq.heappop(self.heap)
+			if self.due.get(key) == at:
+				del self.due[key]
+				fired.append(key)
+		return fired
+
+	# sleeps until the earliest deadline or until an earlier one is scheduled, then hands fire() everything due
+	async def run(self, clock, fire):
+		while True:
+			self.changed.clear()
+			fired = self.pop_due(clock())
+			if fired:
+				await fire(fired)
+				continue
+			at = self.next_at()
+			try:
+				await asyncio.wait_for(self.changed.wait(), None if at is None else max(0, at-clock()))
+			except asyncio.TimeoutError:
+				pass
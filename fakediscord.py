@@ -0,0 +1,254 @@
+import asyncio
+import datetime
+import itertools
+from collections import Counter
+
+
+# in-memory stand-ins for the parts of discord.py the bot touches, for benchmarks and load tests
+
+ids = itertools.count(1000)
+
+
+def utcnow():
+	return datetime.datetime.utcnow()
+
+
+# every fake REST call goes through here so load tests can add latency and count requests
+class Api():
+	def __init__(self, latency=0.0):
+		self.latency = latency
+		self.calls = Counter()
+
+	async def call(self, route):
+		self.calls[route] += 1
+		if self.latency:
+			await asyncio.sleep(self.latency)
+
+
+class Role():
+	def __init__(self, guild, name, id=None):
+		self.guild = guild
+		self.name = name
+		self.id = id or next(ids)
+
+	def __eq__(self, other):
+		return isinstance(other, Role) and other.id == self.id
+
+	def __hash__(self):
+		return hash(self.id)
+
+	@property
+	def members(self):
+		return [m for m in self.guild.members if self in m.roles]
+
+
+class Member():
+	def __init__(self, guild, name, display_name=None, roles=(), bot=False, id=None):
+		self.guild = guild
+		self.id = id or next(ids)
+		self.name = name
+		self.display_name = display_name or name
+		self.roles = list(roles)
+		self.bot = bot
+		self.joined_at = utcnow()
+
+	@property
+	def mention(self):
+		return f"<@{self.id}>"
+
+	async def add_roles(self, *roles):
+		await self.guild.api.call('add_roles')
+		for r in roles:
+			if r not in self.roles:
+				self.roles.append(r)
+
+	async def remove_roles(self, *roles):
+		await self.guild.api.call('remove_roles')
+		self.roles = [r for r in self.roles if r not in roles]
+
+
+class Message():
+	def __init__(self, channel, author, content="", embeds=(), file=None):
+		self.id = next(ids)
+		self.channel = channel
+		self.guild = channel.guild
+		self.author = author
+		self.content = content or ""
+		self.embeds = list(embeds)
+		self.file = file
+		self.created_at = utcnow()
+
+	@property
+	def jump_url(self):
+		return f"https://discord.com/channels/{self.guild.id}/{self.channel.id}/{self.id}"
+
+	async def reply(self, content=None, embed=None, file=None, mention_author=None):
+		return await self.channel.send(content, embed=embed, file=file)
+
+	async def delete(self):
+		await self.guild.api.call('delete_message')
+		if self in self.channel.messages:
+			self.channel.messages.remove(self)
+
+
+class PartialMessage():
+	def __init__(self, channel, id):
+		self.channel = channel
+		self.id = id
+
+	async def delete(self):
+		await self.channel.guild.api.call('delete_message')
+
+
+class History():
+	def __init__(self, channel, limit):
+		self.messages = channel.messages[::-1][:limit]
+
+	async def get(self, **attrs):
+		for m in self.messages:
+			if all(getattr(m, k) == v for k,v in attrs.items()):
+				return m
+		return None
+
+	def __aiter__(self):
+		return self.iterate()
+
+	async def iterate(self):
+		for m in self.messages:
+			yield m
+
+
+class Invite():
+	def __init__(self, channel, inviter, max_age=0, max_uses=0):
+		self.code = "".join(chr(97+int(c)) for c in str(next(ids)))
+		self.channel = channel
+		self.guild = channel.guild
+		self.inviter = inviter
+		self.max_age = max_age
+		self.max_uses = max_uses
+		self.uses = 0
+		self.revoked = False
+		self.created_at = utcnow()
+
+	@property
+	def url(self):
+		return f"https://discord.gg/{self.code}"
+
+	def __str__(self):
+		return self.url
+
+	async def delete(self):
+		await self.guild.api.call('delete_invite')
+		self.revoked = True
+		if self in self.channel.invite_list:
+			self.channel.invite_list.remove(self)
+
+
+class TextChannel():
+	def __init__(self, guild, name, id=None):
+		self.guild = guild
+		self.name = name
+		self.id = id or next(ids)
+		self.messages = []
+		self.invite_list = []
+
+	@property
+	def mention(self):
+		return f"<#{self.id}>"
+
+	def post(self, author, content="", embeds=()):
+		message = Message(self, author, content, embeds)
+		self.messages.append(message)
+		return message
+
+	async def send(self, content=None, embed=None, file=None):
+		await self.guild.api.call('send')
+		message = Message(self, self.guild.me, content, [embed] if embed else [], file)
+		self.messages.append(message)
+		return message
+
+	def history(self, limit=100):
+		self.guild.api.calls['history'] += 1
+		return History(self, limit)
+
+	async def purge(self, check=None, limit=100):
+		await self.guild.api.call('purge')
+		doomed = [m for m in self.messages[::-1][:limit] if not check or check(m)]
+		self.messages = [m for m in self.messages if m not in doomed]
+		return doomed
+
+	def get_partial_message(self, message_id):
+		return next((m for m in self.messages if m.id == message_id), PartialMessage(self, message_id))
+
+	async def delete_messages(self, messages):
+		await self.guild.api.call('delete_messages')
+		ids = {m.id for m in messages}
+		self.messages = [m for m in self.messages if m.id not in ids]
+
+	async def invites(self):
+		await self.guild.api.call('invites')
+		return list(self.invite_list)
+
+	async def create_invite(self, max_age=0, max_uses=0):
+		await self.guild.api.call('create_invite')
+		invite = Invite(self, self.guild.me, max_age, max_uses)
+		self.invite_list.append(invite)
+		return invite
+
+	async def edit(self, name=None):
+		await self.guild.api.call('edit_channel')
+		if name:
+			self.name = name
+
+
+class Emoji():
+	def __init__(self, name):
+		self.url = f"https://example.invalid/{name}.png"
+
+
+class Guild():
+	def __init__(self, id=None, api=None):
+		self.id = id or next(ids)
+		self.api = api or Api()
+		self.roles = []
+		self.channels = []
+		self.emojis = [Emoji("blob")]
+		self.member_map = {}
+		self.me = None
+
+	@property
+	def members(self):
+		return list(self.member_map.values())
+
+	def get_member(self, member_id):
+		return self.member_map.get(member_id)
+
+	def add_role(self, name, id=None):
+		role = Role(self, name, id)
+		self.roles.append(role)
+		return role
+
+	def add_channel(self, name, id=None):
+		channel = TextChannel(self, name, id)
+		self.channels.append(channel)
+		return channel
+
+	def add_member(self, name, display_name=None, roles=(), bot=False, id=None):
+		member = Member(self, name, display_name, roles, bot, id)
+		self.member_map[member.id] = member
+		return member
+
+	def remove_member(self, member_id):
+		return self.member_map.pop(member_id, None)
+
+
+class Client():
+	def __init__(self, guilds=(), user=None):
+		self.guilds = list(guilds)
+		self.user = user
+
+	def get_guild(self, guild_id):
+		for g in self.guilds:
+			if g.id == guild_id:
+				return g
+		return None
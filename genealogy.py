@@ -0,0 +1,99 @@
+# ancestor/descendant closure table over bestowments
+# every indexed member has a (member, member, 0) row; depth is generations apart
+
+SCHEMA = "genealogy (ancestor int, descendant int, depth int, PRIMARY KEY (ancestor, descendant))"
+INDEX = "CREATE INDEX IF NOT EXISTS genealogy_descendant ON genealogy (descendant, depth)"
+
+INVITE_NUMBER = "(SELECT MIN(rowid) FROM bestowments WHERE bestowee = {} AND bestower != bestowee)"
+
+
+def record(con, bestower, bestowee):
+	if bestower is None or bestowee is None or bestower == bestowee:
+		return False
+
+	con.execute("INSERT OR IGNORE INTO genealogy (ancestor, descendant, depth) VALUES (?,?,0)",[bestower,bestower])
+	con.execute("INSERT OR IGNORE INTO genealogy (ancestor, descendant, depth) VALUES (?,?,0)",[bestowee,bestowee])
+
+	# first parent wins, and never graft a member under its own descendant
+	cur = con.execute("SELECT 1 FROM genealogy WHERE (descendant = ? AND depth > 0) OR (ancestor = ? AND descendant = ?) LIMIT 1",[bestowee,bestowee,bestower])
+	if cur.fetchall():
+		return False
+
+	con.execute("""INSERT OR IGNORE INTO genealogy (ancestor, descendant, depth)
+		SELECT a.ancestor, d.descendant, a.depth + d.depth + 1
+		FROM genealogy a, genealogy d
+		WHERE a.descendant = ? AND d.ancestor = ?""",[bestower,bestowee])
+	return True
+
+
+def rebuild(con):
+	con.execute("DELETE FROM genealogy")
+	cur = con.execute("SELECT bestower, bestowee FROM bestowments WHERE bestowee IS NOT NULL AND bestower != bestowee ORDER BY rowid")
+	for bestower, bestowee in cur.fetchall():
+		record(con, bestower, bestowee)
+
+
+def count_descendants(con, member_id):
+	cur = con.execute("SELECT COUNT(*) FROM genealogy WHERE ancestor = ? AND depth > 0",[member_id])
+	return cur.fetchall()[0][0]
+
+
+# [(member_id, invite_number)] from the oldest ancestor down to member_id
+def lineage(con, member_id):
+	cur = con.execute("SELECT g.ancestor, "+INVITE_NUMBER.format("g.ancestor")+" FROM genealogy g WHERE g.descendant = ? ORDER BY g.depth DESC",[member_id])
+	rows = [(q[0], q[1] or 0) for q in cur.fetchall()]
+	if not rows:
+		cur = con.execute("SELECT "+INVITE_NUMBER.format("?"),[member_id])
+		rows = [(member_id, cur.fetchall()[0][0] or 0)]
+	return rows
+
+
+# {parent_id: [(invite_number, child_id), ...]} for everything below member_id
+def subtree(con, member_id):
+	cur = con.execute("""SELECT p.ancestor, g.descendant, """+INVITE_NUMBER.format("g.descendant")+"""
+		FROM genealogy g
+		JOIN genealogy p ON p.descendant = g.descendant AND p.depth = 1
+		WHERE g.ancestor = ? AND g.depth > 0""",[member_id])
+	children = {}
+	for parent, child, invite_number in cur.fetchall():
+		children.setdefault(parent,[]).append((invite_number or 0, child))
+	for c in children.values():
+		c.sort()
+	return children
+
+
+# member is (name, active) for someone still in the guild, None once they've left
+def display_name(member_id, member, showall=False):
+	name = f"<@{member_id}>"
+	if member and (not member[1] or showall):
+		name = member[0]
+	if not member:
+		name = "~~"+name+"~~"
+	return name
+
+
+# indented lines for everything under member_id, depth first, without recursion
+# members is {id: (name, active)} so this can run in a worker process
+def render_progeny(member_id, children, members, showall=False, max_depth=None, max_breadth=None):
+	lines = []
+	stack = [(0,children.get(member_id,[]),0)]
+	while stack:
+		depth,siblings,i = stack.pop()
+		if i >= len(siblings):
+			continue
+		indent = '`  ` '*(depth-1)+'`  `' if depth else ''
+		if max_breadth and i >= max_breadth:
+			lines.append(f"{indent}...and {len(siblings)-i} more")
+			continue
+		stack.append((depth,siblings,i+1))
+
+		invite_number,child = siblings[i]
+		grandchildren = children.get(child,[])
+		line = f"{indent}#{invite_number} {display_name(child,members.get(child),showall)}"
+		if grandchildren and max_depth and depth+1 >= max_depth:
+			line += f" (+{len(grandchildren)})"
+			grandchildren = []
+		lines.append(line)
+		if grandchildren:
+			stack.append((depth+1,grandchildren,0))
+	return lines
@@ -0,0 +1,103 @@
+import asyncio
+import traceback
+
+import discord
+
+import compute
+import logsink
+from bot import Bot
+from metrics import Metrics
+
+
+# one guild's settings, falling back to the shared config for anything it doesn't override
+class GuildConfig():
+	def __init__(self, base, overrides):
+		self.base = base
+		self.overrides = overrides
+
+	def __getattr__(self, name):
+		if name in self.overrides:
+			return self.overrides[name]
+		return getattr(self.base, name)
+
+
+# runs a separate Bot, with its own state, database and audit loop, for every configured guild on one sharded connection
+class Guilds():
+	def __init__(self, debug=True):
+		self.debug = debug
+		self.bots = {}
+		self.metrics = Metrics()
+		intents = discord.Intents.default()
+		intents.members = True
+		self.client = discord.AutoShardedClient(intents=intents)
+		self.metrics.instrument_http(self.client.http)
+
+	def log(self, m):
+		print(m)
+
+	def setup_guilds(self, config):
+		guilds = {config.GUILD: {}} if config.GUILD else {}
+		guilds.update(getattr(config, 'GUILDS', {}))
+		for guild_id,overrides in guilds.items():
+			path = overrides.get('DB_PATH', "db.db" if guild_id == config.GUILD else f"db-{guild_id}.db")
+			bot = Bot(self.debug, path, self.client, self.metrics)
+			bot.config = GuildConfig(config, dict(overrides, GUILD=guild_id))
+			self.bots[guild_id] = bot
+
+	def start_bot(self, config):
+		self.config = config
+		self.setup_guilds(config)
+		logsink.flush_before_close(self.client, [bot.logs for bot in self.bots.values()])
+		try:
+			self.client.run(config.TOKEN)
+		finally:
+			for bot in self.bots.values():
+				bot.flush_activity().result()
+				bot.db.close()
+			compute.shutdown()
+
+	def bot_for(self, guild):
+		return self.bots.get(guild.id) if guild else None
+
+	# EVENTS
+
+	async def on_ready(self):
+		ids = list(self.bots)
+		results = await asyncio.gather(*[self.bots[i].on_ready() for i in ids], return_exceptions=True)
+		for guild_id,r in zip(ids, results):
+			if isinstance(r, Exception):
+				self.log(f"guild {guild_id} failed to start:\n"+"".join(traceback.format_exception(type(r), r, r.__traceback__)))
+
+	async def on_message(self, m):
+		bot = self.bot_for(m.guild)
+		if bot:
+			await bot.on_message(m)
+
+	async def on_member_join(self, member):
+		bot = self.bot_for(member.guild)
+		if bot:
+			await bot.on_member_join(member)
+
+	async def on_member_update(self, before, after):
+		bot = self.bot_for(after.guild)
+		if bot:
+			await bot.on_member_update(before, after)
+
+	# users aren't tied to a guild, so every bot checks whether it knows them
+	async def on_user_update(self, before, after):
+		await asyncio.gather(*[bot.on_user_update(before, after) for bot in self.bots.values()], return_exceptions=True)
+
+	async def on_member_remove(self, member):
+		bot = self.bot_for(member.guild)
+		if bot:
+			await bot.on_member_remove(member)
+
+	async def on_invite_create(self, invite):
+		bot = self.bot_for(invite.guild)
+		if bot:
+			await bot.on_invite_create(invite)
+
+	async def on_invite_delete(self, invite):
+		bot = self.bot_for(invite.guild)
+		if bot:
+			await bot.on_invite_delete(invite)
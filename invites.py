@@ -0,0 +1,37 @@
+import datetime
+
+
+# local view of the lobby's invites, seeded from the API and kept current from gateway events
+class InviteRegistry():
+	def __init__(self, channel_id=None):
+		self.channel_id = channel_id
+		self.invites = {}
+
+	def seed(self, invites):
+		self.invites = {}
+		for i in invites:
+			self.add(i)
+
+	def add(self, invite):
+		if self.channel_id and invite.channel and invite.channel.id != self.channel_id:
+			return
+		self.invites[invite.code] = invite
+
+	def remove(self, invite):
+		self.invites.pop(invite.code, None)
+
+	def expired(self, invite, now):
+		if invite.revoked or (invite.max_uses and invite.uses and invite.uses >= invite.max_uses):
+			return True
+		if not invite.max_age or not invite.created_at:
+			return False
+		created_at = invite.created_at
+		if created_at.tzinfo is None:
+			created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+		return created_at + datetime.timedelta(seconds=invite.max_age) <= now
+
+	def active(self, inviter_id):
+		now = datetime.datetime.now(datetime.timezone.utc)
+		for code in [c for c,i in self.invites.items() if self.expired(i, now)]:
+			del self.invites[code]
+		return [i for i in self.invites.values() if i.inviter and i.inviter.id == inviter_id]
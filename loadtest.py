@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# replays gateway-style event streams against the bot on a fake discord to see how much load it takes
+#
+#   python loadtest.py --rate 200 --duration 20
+#   python loadtest.py --ramp --rate 50 --max-lag 0.1
+#   python loadtest.py --record events.jsonl    then    python loadtest.py --replay events.jsonl
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+
+import discord
+
+import fakediscord
+from actions import ActionQueue
+from bench import DAY, populate, random_name
+from bot import Bot
+
+MIX = {
+	'message': 0.925,
+	'gif': 0.03,
+	'command': 0.03,
+	'pass': 0.005,
+	'join': 0.005,
+	'leave': 0.005
+}
+
+COMMANDS = ["bot stats", "bot stats s", "bot stats xs", "bot progeny", "bot progeni", "bot lineage", "bot liniage", "bot help"]
+
+
+def synthetic_events(rate, duration, audit_every):
+	events = []
+	t = 0.0
+	kinds, weights = zip(*MIX.items())
+	while t < duration:
+		t += random.expovariate(rate)
+		kind = random.choices(kinds, weights)[0]
+		event = {'t': t, 'type': kind, 'member': random.randrange(1 << 30)}
+		if kind == 'message':
+			event['content'] = random_name()+" "+random_name()
+		elif kind == 'command':
+			event['content'] = random.choice(COMMANDS)
+		events.append(event)
+	events += [{'t': i*audit_every, 'type': 'audit'} for i in range(1, int(duration/audit_every)+1)]
+	events.sort(key=lambda e: e['t'])
+	return events
+
+
+async def build_world(size, shape, path, api_latency, api_rate):
+	guild = fakediscord.Guild(api=fakediscord.Api(api_latency))
+	roles = {k: guild.add_role(k) for k in ['active','bestower','he','she','they']}
+	channels = {k: guild.add_channel(k) for k in ['bestowment','lobby','public_log','private_log','sex_gifs','spam','general']}
+	guild.me = fakediscord.Member(guild, "blitherbot", bot=True)
+
+	taq = guild.add_member("taq", roles=[roles['active']])
+	eg = guild.add_member("eg", roles=[roles['active']])
+	members = [guild.add_member(random_name(), random_name(), [roles['active']] if random.random() < .9 else []) for i in range(size)]
+
+	bot = Bot(False, path)
+	bot.log = lambda m: None
+	bot.actions = ActionQueue(concurrency=64, rate=10**6, per=1.0)
+	bot.client = fakediscord.Client([guild], guild.me)
+	bot.config = SimpleNamespace(
+		TOKEN='', GUILD=guild.id, TAQ=taq.id, EG=eg.id, INVITE_DURATION=DAY*2,
+		ACTIVE_ROLE=roles['active'].id, BESTOWER_ROLE=roles['bestower'].id,
+		HE_ROLE=roles['he'].id, SHE_ROLE=roles['she'].id, THEY_ROLE=roles['they'].id,
+		BESTOWMENT_CHANNEL=channels['bestowment'].id, LOBBY_CHANNEL=channels['lobby'].id,
+		PUBLIC_LOG_CHANNEL=channels['public_log'].id, PRIVATE_LOG_CHANNEL=channels['private_log'].id,
+		SEX_GIFS_CHANNEL=channels['sex_gifs'].id, SPAM_CHANNELS=[channels['spam'].id]
+	)
+	bot.db.run_sync(lambda con: populate(con, [taq, eg]+members, shape, bot.epoch()))
+	channels['sex_gifs'].post(guild.me, embeds=[discord.Embed(description="NEW THEME: SEEDS")])
+
+	await bot.on_ready()
+	bot.stop_auditing()
+	await bot.bestow()
+	bot.actions = ActionQueue(rate=api_rate, per=1.0)
+	return bot, guild, channels, roles
+
+
+class Driver():
+	def __init__(self, bot, guild, channels, roles):
+		self.bot = bot
+		self.guild = guild
+		self.channels = channels
+		self.roles = roles
+		self.latencies = defaultdict(list)
+		self.errors = defaultdict(int)
+		self.lag = []
+
+	def member(self, n):
+		members = [m for m in self.guild.members if not m.bot]
+		return members[n % len(members)]
+
+	def handler(self, event):
+		kind = event['type']
+		if kind == 'audit':
+			return self.bot.audit()
+		if kind == 'join':
+			member = self.guild.add_member(random_name())
+			return self.bot.on_member_join(member)
+		if kind == 'leave':
+			member = self.guild.remove_member(self.member(event['member']).id)
+			return self.bot.on_member_remove(member)
+		if kind == 'pass':
+			bestowers = [self.guild.get_member(i) for i in self.bot.bestower_ids]
+			author = next((m for m in bestowers if m), self.member(event['member']))
+			return self.bot.on_message(self.channels['spam'].post(author, "bot pass"))
+		if kind == 'gif':
+			return self.bot.on_message(self.channels['sex_gifs'].post(self.member(event['member']), "https://tenor.com/view/"+random_name()+".gif"))
+		if kind == 'command':
+			return self.bot.on_message(self.channels['spam'].post(self.member(event['member']), event['content']))
+		return self.bot.on_message(self.channels['general'].post(self.member(event['member']), event.get('content', "")))
+
+	async def timed(self, event):
+		start = time.perf_counter()
+		try:
+			await self.handler(event)
+		except Exception:
+			self.errors[event['type']] += 1
+		self.latencies[event['type']].append(time.perf_counter()-start)
+
+	async def monitor_lag(self, interval=0.01):
+		loop = asyncio.get_running_loop()
+		while True:
+			start = loop.time()
+			await asyncio.sleep(interval)
+			self.lag.append(loop.time()-start-interval)
+
+	async def replay(self, events, speed=1.0):
+		loop = asyncio.get_running_loop()
+		monitor = asyncio.create_task(self.monitor_lag())
+		tasks = []
+		start = loop.time()
+		for event in events:
+			delay = start+event['t']/speed-loop.time()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			tasks.append(asyncio.create_task(self.timed(event)))
+		await asyncio.gather(*tasks)
+		monitor.cancel()
+		return loop.time()-start
+
+
+def percentile(values, p):
+	values = sorted(values)
+	return values[min(len(values)-1, int(len(values)*p))] if values else 0.0
+
+
+def report(driver, elapsed, events, commits, calls):
+	print(f"\n{len(events)} events in {elapsed:.2f}s ({len(events)/elapsed:.1f}/s)")
+	print(f"event loop lag: p50 {percentile(driver.lag,.5)*1000:.1f}ms  p99 {percentile(driver.lag,.99)*1000:.1f}ms  max {max(driver.lag or [0])*1000:.1f}ms")
+	print(f"db commits: {commits}")
+	print("api calls: "+", ".join(f"{k} {v}" for k,v in sorted(calls.items())))
+	print(f"\n  {'event':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+	for kind,values in sorted(driver.latencies.items()):
+		print(f"  {kind:<10}{len(values):>8}{percentile(values,.5)*1000:>10.2f}{percentile(values,.95)*1000:>10.2f}{percentile(values,.99)*1000:>10.2f}{max(values)*1000:>10.2f}{driver.errors[kind]:>8}")
+
+
+async def run(args, events):
+	with tempfile.TemporaryDirectory() as d:
+		bot, guild, channels, roles = await build_world(args.members, args.shape, os.path.join(d, "load.db"), args.api_latency, args.api_rate)
+		try:
+			if not args.ramp:
+				driver = Driver(bot, guild, channels, roles)
+				commits, calls = bot.db.commits, guild.api.calls.copy()
+				elapsed = await driver.replay(events, args.speed)
+				report(driver, elapsed, events, bot.db.commits-commits, guild.api.calls-calls)
+				return
+
+			rate = args.rate
+			sustained = None
+			while True:
+				driver = Driver(bot, guild, channels, roles)
+				step = synthetic_events(rate, args.step, args.audit_every)
+				await driver.replay(step)
+				lag = percentile(driver.lag, .99)
+				print(f"{rate:>8.0f} events/s  p99 lag {lag*1000:.1f}ms")
+				if lag > args.max_lag:
+					break
+				sustained = rate
+				rate *= 2
+			print(f"\nsustained about {sustained or 0:.0f} events/s before p99 loop lag passed {args.max_lag*1000:.0f}ms")
+		finally:
+			bot.flush_activity().result()
+			bot.db.close()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Replay event streams against the bot on a fake discord.")
+	parser.add_argument("--members", type=int, default=1000)
+	parser.add_argument("--shape", default="wide", help="bestowment tree shape: wide or deep")
+	parser.add_argument("--rate", type=float, default=100, help="events per second")
+	parser.add_argument("--duration", type=float, default=10, help="seconds of synthetic events")
+	parser.add_argument("--audit-every", type=float, default=5, help="seconds between audit ticks")
+	parser.add_argument("--api-latency", type=float, default=0.0, help="seconds added to every fake REST call")
+	parser.add_argument("--api-rate", type=float, default=50, help="fake REST calls allowed per second per route")
+	parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier")
+	parser.add_argument("--replay", metavar="FILE", help="replay a recorded JSONL event stream")
+	parser.add_argument("--record", metavar="FILE", help="save the synthetic event stream as JSONL")
+	parser.add_argument("--ramp", action="store_true", help="double the rate each step until loop lag passes --max-lag")
+	parser.add_argument("--step", type=float, default=5, help="seconds per ramp step")
+	parser.add_argument("--max-lag", type=float, default=0.1, help="p99 event loop lag, in seconds, that ends a ramp")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	random.seed(args.seed)
+	if args.replay:
+		with open(args.replay) as f:
+			events = [json.loads(l) for l in f if l.strip()]
+	else:
+		events = synthetic_events(args.rate, args.duration, args.audit_every)
+
+	if args.record:
+		with open(args.record, 'w') as f:
+			for e in events:
+				f.write(json.dumps(e)+"\n")
+
+	asyncio.run(run(args, events))
+
+
+if __name__ == "__main__":
+	main()
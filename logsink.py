@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+
+# buffers log lines per channel and hands them to send(channel, lines) in as few batches as possible
+# a line repeated back to back, like the same traceback over and over, is folded into one line with a count
+class LogSink():
+	def __init__(self, send, limit=500, policy='drop', alert_window=300):
+		self.send = send
+		self.limit = limit
+		self.policy = policy
+		self.alert_window = alert_window
+		self.lanes = {}
+		self.dropped = {}
+		self.alerts = {}
+		self.flushed = asyncio.Event()
+		self.lock = asyncio.Lock()
+
+	def __len__(self):
+		return sum(len(lines) for lines in self.lanes.values())
+
+	# 'drop' discards lines once a channel's buffer is full, 'wait' holds the caller until the next flush
+	async def put(self, channel, line):
+		lines = self.lanes.setdefault(channel, [])
+		while not (lines and lines[-1][0] == line) and len(lines) >= self.limit:
+			if self.policy != 'wait':
+				self.dropped[channel] = self.dropped.get(channel, 0)+1
+				return
+			self.flushed.clear()
+			await self.flushed.wait()
+			lines = self.lanes.setdefault(channel, [])
+		if lines and lines[-1][0] == line:
+			lines[-1][1] += 1
+		else:
+			lines.append([line, 1])
+
+	# the same alert twice inside the window only pings once, the repeats go out with the batched lines
+	def repeated_alert(self, line):
+		now = time.monotonic()
+		self.alerts = {a: t for a,t in self.alerts.items() if now-t < self.alert_window}
+		if line in self.alerts:
+			return True
+		self.alerts[line] = now
+		return False
+
+	async def flush(self):
+		async with self.lock:
+			lanes, dropped = self.lanes, self.dropped
+			self.lanes, self.dropped = {}, {}
+			self.flushed.set()
+			for channel,lines in lanes.items():
+				batch = [line if n == 1 else f"{line}\n(x{n})" for line,n in lines]
+				if dropped.get(channel):
+					batch.append(f"(dropped {dropped[channel]} more lines)")
+				await self.send(channel, batch)
+
+
+# has client.close() flush the sinks first, while the loop is still running and the channels can still be sent to
+def flush_before_close(client, sinks):
+	close = client.close
+	async def flushing_close():
+		try:
+			for sink in sinks:
+				await sink.flush()
+		finally:
+			await close()
+	client.close = flushing_close
@@ -1,7 +1,7 @@
 #!/usr/bin/env LC_ALL=en_US.UTF-8 /usr/local/bin/python3.6
 
 from config import config
-from bot import Bot
+from guilds import Guilds
 
 import sys
 sys.stdout = open(1, 'w', encoding='utf-8', closefd=False)
@@ -10,7 +10,7 @@ global b
 
 
 if __name__ == "__main__":
-    b = Bot(False)
+    b = Guilds(False)
 else:
 	exit()
 
@@ -26,4 +26,24 @@ async def on_message(message):
 async def on_member_join(member):
 	await b.on_member_join(member)
 
+@b.client.event
+async def on_member_update(before, after):
+	await b.on_member_update(before, after)
+
+@b.client.event
+async def on_user_update(before, after):
+	await b.on_user_update(before, after)
+
+@b.client.event
+async def on_member_remove(member):
+	await b.on_member_remove(member)
+
+@b.client.event
+async def on_invite_create(invite):
+	await b.on_invite_create(invite)
+
+@b.client.event
+async def on_invite_delete(invite):
+	await b.on_invite_delete(invite)
+
 b.start_bot(config)
@@ -0,0 +1,43 @@
+# raffle stats for eligible members, computed over columns instead of per member queries
+
+QUERIES = {
+	'touch': "SELECT member, MAX(rowid) FROM (SELECT rowid, bestower AS member FROM bestowments UNION ALL SELECT rowid, bestowee FROM bestowments WHERE bestowee IS NOT NULL) GROUP BY member",
+	'inactive': "SELECT member, MAX(bestowment_id) FROM inactivity GROUP BY member",
+	'invite_number': "SELECT bestowee, MAX(rowid) FROM bestowments WHERE bestowee IS NOT NULL GROUP BY bestowee",
+	'bestowments': "SELECT bestower, COUNT(rowid) FROM bestowments GROUP BY bestower",
+	'children': "SELECT ancestor, COUNT(*) FROM genealogy WHERE depth > 0 GROUP BY ancestor"
+}
+
+
+def load(con):
+	return {k: dict(con.execute(q).fetchall()) for k,q in QUERIES.items()}
+
+
+def compile(ids, aggregates):
+	if not ids:
+		return []
+
+	touch = [aggregates['touch'].get(i,0) for i in ids]
+	inactive = [aggregates['inactive'].get(i) for i in ids]
+	invite_number = [aggregates['invite_number'].get(i,0) for i in ids]
+	bestowments = [aggregates['bestowments'].get(i,0) for i in ids]
+	children = [aggregates['children'].get(i,0) for i in ids]
+	effective_touch = [l if l and l > t else t for t,l in zip(touch,inactive)]
+
+	ceiling = max(touch)+max(bestowments)+max(children)
+	tickets = [ceiling-e-b-c for e,b,c in zip(effective_touch,bestowments,children)]
+	total_tickets = sum(tickets)
+	chance = [t/total_tickets for t in tickets] if total_tickets else [1/len(ids)]*len(ids)
+
+	columns = {
+		'id': ids,
+		'touch': touch,
+		'effective_touch': effective_touch,
+		'bestowments': bestowments,
+		'children': children,
+		'inactive': inactive,
+		'invite_number': invite_number,
+		'tickets': tickets,
+		'chance': chance
+	}
+	return [dict(zip(columns,row)) for row in zip(*columns.values())]
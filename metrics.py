@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import re
+import threading
+import time
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+def statement(sql):
+	words = re.match(r"\s*(\w+).*?\b(?:FROM|INTO|UPDATE)\s+(\w+)", sql, re.I | re.S)
+	return f"{words[1].lower()} {words[2]}" if words else sql.split()[0].lower()
+
+
+class Histogram():
+	def __init__(self):
+		self.counts = [0]*len(BUCKETS)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, value):
+		for i,bound in enumerate(BUCKETS):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+		self.count += 1
+		self.sum += value
+		self.max = max(self.max, value)
+
+	def quantile(self, q):
+		target = q*self.count
+		seen = 0
+		for bound,count in zip(BUCKETS, self.counts):
+			seen += count
+			if seen >= target:
+				return min(bound, self.max)
+		return self.max
+
+
+# counters and latency histograms, safe to update from the db threads
+class Metrics():
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counters = {}
+		self.histograms = {}
+		self.started = time.time()
+		self.lag_task = None
+		self.server = None
+
+	def key(self, name, labels):
+		return (name, tuple(sorted(labels.items())))
+
+	def inc(self, name, amount=1, **labels):
+		key = self.key(name, labels)
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0)+amount
+
+	def observe(self, name, value, **labels):
+		key = self.key(name, labels)
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = Histogram()
+			self.histograms[key].observe(value)
+
+	@contextlib.contextmanager
+	def timer(self, name, **labels):
+		start = time.perf_counter()
+		try:
+			yield
+		except Exception:
+			self.inc(name.replace('_seconds','_errors_total'), **labels)
+			raise
+		finally:
+			self.observe(name, time.perf_counter()-start, **labels)
+
+	# every REST call discord.py makes goes through http.request
+	def instrument_http(self, http):
+		request = http.request
+		async def timed_request(route, **kwargs):
+			with self.timer('api_seconds', route=f"{route.method} {route.path}"):
+				return await request(route, **kwargs)
+		http.request = timed_request
+
+	# safe to call from every guild's on_ready, only the first call starts anything
+	async def start(self, port=None):
+		if not self.lag_task:
+			self.lag_task = asyncio.create_task(self.monitor_lag())
+		if port and not self.server:
+			self.server = await asyncio.start_server(self.serve, '127.0.0.1', port)
+
+	# how late a one second sleep wakes up is how long callbacks are waiting on the loop
+	async def monitor_lag(self, interval=1.0):
+		loop = asyncio.get_running_loop()
+		while True:
+			start = loop.time()
+			await asyncio.sleep(interval)
+			self.observe('event_loop_lag_seconds', loop.time()-start-interval)
+
+	# plain prometheus text for anything scraping localhost
+	async def serve(self, reader, writer):
+		try:
+			while (await asyncio.wait_for(reader.readline(), 5)).strip():
+				pass
+			body = self.prometheus().encode()
+			writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: "+str(len(body)).encode()+b"\r\n\r\n"+body)
+			await writer.drain()
+		except (asyncio.TimeoutError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	def prometheus(self):
+		lines = []
+		with self.lock:
+			for (name,labels),value in sorted(self.counters.items()):
+				lines.append(f"{name}{self.format_labels(labels)} {value}")
+			for (name,labels),h in sorted(self.histograms.items()):
+				cumulative = 0
+				for bound,count in zip(BUCKETS, h.counts):
+					cumulative += count
+					le = "+Inf" if bound == float('inf') else repr(bound)
+					lines.append(f"{name}_bucket{self.format_labels(labels+(('le',le),))} {cumulative}")
+				lines.append(f"{name}_sum{self.format_labels(labels)} {h.sum}")
+				lines.append(f"{name}_count{self.format_labels(labels)} {h.count}")
+		return "\n".join(lines)+"\n"
+
+	def format_labels(self, labels):
+		if not labels:
+			return ""
+		return "{"+",".join(f'{k}="{v}"' for k,v in labels)+"}"
+
+	# one line per series, slowest total time first
+	def digest(self, limit=20):
+		with self.lock:
+			series = sorted(self.histograms.items(), key=lambda i: i[1].sum, reverse=True)[:limit]
+			errors = {k: v for k,v in self.counters.items() if k[0].endswith('_errors_total')}
+		lines = [f"uptime {round((time.time()-self.started)/3600,1)}h"]
+		for (name,labels),h in series:
+			label = " ".join([name.replace('_seconds','')]+[str(v) for k,v in labels])
+			lines.append(f"`{label}`: {h.count}x avg {h.sum/h.count*1000:.1f}ms p95 {h.quantile(.95)*1000:.0f}ms max {h.max*1000:.0f}ms")
+		for (name,labels),value in sorted(errors.items()):
+			lines.append(f"`{' '.join([name]+[str(v) for k,v in labels])}`: {value}")
+		return "\n".join(lines)
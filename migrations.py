@@ -0,0 +1,82 @@
+import activity
+import genealogy
+import posts
+import snapshots
+
+
+# each migration runs once, in order, in its own transaction; PRAGMA user_version counts the ones applied
+# dbs from before versioning start at 0, so the early steps tolerate work that is already done
+
+def create_tables(con):
+	for t in [
+		"messages (sent_at int, sent_by int unique)",
+		"bestowments (link text, bestower int, bestowee int, given_to_bestower_at int, bestowee_joined_at int, released_at int)",
+		"inactivity (bestowment_id int, member int unique)"
+	]:
+		con.execute("CREATE TABLE IF NOT EXISTS "+t)
+
+
+def create_genealogy(con):
+	con.execute("CREATE TABLE IF NOT EXISTS "+genealogy.SCHEMA)
+	con.execute(genealogy.INDEX)
+	if not con.execute("SELECT 1 FROM genealogy LIMIT 1").fetchall():
+		genealogy.rebuild(con)
+
+
+# timestamps used to be stored as datetime strings
+def epoch_timestamps(con):
+	for table,column in [("messages","sent_at"),("bestowments","given_to_bestower_at"),("bestowments","bestowee_joined_at"),("bestowments","released_at")]:
+		con.execute(f"UPDATE {table} SET {column} = CAST(strftime('%s', substr({column},1,19)) AS INTEGER) WHERE typeof({column}) = 'text'")
+
+
+def create_indexes(con):
+	for i in [
+		"messages_sent_at ON messages (sent_at)",
+		"bestowments_bestower ON bestowments (bestower, bestowee)",
+		"bestowments_bestowee ON bestowments (bestowee, bestower)",
+		"bestowments_given ON bestowments (given_to_bestower_at, bestower, bestowee)",
+		"inactivity_member ON inactivity (member, bestowment_id)"
+	]:
+		con.execute("CREATE INDEX IF NOT EXISTS "+i)
+
+
+def create_activity(con):
+	con.execute("CREATE TABLE IF NOT EXISTS "+activity.SCHEMA)
+
+
+
+def create_posts(con):
+	con.execute("CREATE TABLE IF NOT EXISTS "+posts.SCHEMA)
+
+
+
+def create_snapshots(con):
+	con.execute("CREATE TABLE IF NOT EXISTS "+snapshots.SCHEMA)
+
+
+MIGRATIONS = [
+	create_tables,
+	create_genealogy,
+	epoch_timestamps,
+	create_indexes,
+	create_activity,
+	create_posts,
+	create_snapshots
+]
+
+
+def migrate(con):
+	version = con.execute("PRAGMA user_version").fetchall()[0][0]
+	for i,migration in enumerate(MIGRATIONS[version:], start=version+1):
+		con.execute("BEGIN")
+		try:
+			migration(con)
+			con.execute(f"PRAGMA user_version = {i}")
+			con.commit()
+		except Exception:
+			con.rollback()
+			raise
+	if version < len(MIGRATIONS):
+		con.execute("ANALYZE")
+	con.execute("PRAGMA optimize")
+	return version
@@ -0,0 +1,106 @@
+import bisect
+import difflib
+from collections import Counter
+
+# how many of the names sharing the most trigrams with a query get the full fuzzy comparison
+FUZZY_CANDIDATES = 50
+
+
+def trigrams(name):
+	padded = f"  {name} "
+	return {padded[i:i+3] for i in range(len(padded)-2)}
+
+
+# lowercased names and display names kept in sorted arrays for exact and prefix lookups
+# plus a trigram index so near misses only get compared against likely spellings
+class NameIndex():
+	KINDS = ['name','display_name']
+
+	def __init__(self, members=()):
+		self.keys = {k: [] for k in self.KINDS}
+		self.members = {}
+		self.name_counts = Counter()
+		self.grams = {}
+		for m in members:
+			self.add(m)
+
+	def __len__(self):
+		return len(self.members)
+
+	def add(self, member):
+		if member.bot:
+			return
+		if member.id in self.members:
+			self.remove(member.id)
+		names = (member.name.lower(), member.display_name.lower())
+		self.members[member.id] = names
+		for kind,name in zip(self.KINDS,names):
+			bisect.insort(self.keys[kind], (name, member.id))
+		for name in set(names):
+			self.name_counts[name] += 1
+			if self.name_counts[name] == 1:
+				for g in trigrams(name):
+					self.grams.setdefault(g, set()).add(name)
+
+	def remove(self, member_id):
+		names = self.members.pop(member_id, None)
+		if not names:
+			return
+		for kind,name in zip(self.KINDS,names):
+			keys = self.keys[kind]
+			i = bisect.bisect_left(keys, (name, member_id))
+			if i < len(keys) and keys[i] == (name, member_id):
+				del keys[i]
+		for name in set(names):
+			self.name_counts[name] -= 1
+			if self.name_counts[name] <= 0:
+				del self.name_counts[name]
+				for g in trigrams(name):
+					self.grams[g].discard(name)
+					if not self.grams[g]:
+						del self.grams[g]
+
+	def update(self, member):
+		names = (member.name.lower(), member.display_name.lower())
+		if self.members.get(member.id) == names:
+			return False
+		self.add(member)
+		return True
+
+	def prefixed(self, kind, prefix):
+		keys = self.keys[kind]
+		i = bisect.bisect_left(keys, (prefix,))
+		while i < len(keys) and keys[i][0].startswith(prefix):
+			yield keys[i]
+			i += 1
+
+	# member ids ranked exact name, exact display name, name prefix, display name prefix, shortest first
+	# falls back to close spellings when nothing matches
+	def search(self, query):
+		query = query.lower()
+		candidates = {member_id for kind in self.KINDS for name,member_id in self.prefixed(kind, query)}
+		tiers = {'exact name': [], 'exact display name': [], 'name': [], 'display_name': []}
+		for member_id in candidates:
+			name, display_name = self.members[member_id]
+			if name == query:
+				tiers['exact name'].append((len(name), member_id))
+			elif display_name == query:
+				tiers['exact display name'].append((len(display_name), member_id))
+			elif name.startswith(query):
+				tiers['name'].append((len(name), member_id))
+			else:
+				tiers['display_name'].append((len(display_name), member_id))
+
+		ranked = [member_id for tier in tiers.values() for length,member_id in sorted(tier)]
+		if ranked:
+			return ranked
+
+		shared = Counter()
+		for g in trigrams(query):
+			shared.update(self.grams.get(g, ()))
+		close = difflib.get_close_matches(query, [n for n,count in shared.most_common(FUZZY_CANDIDATES)], n=3, cutoff=0.75)
+		return list(dict.fromkeys(member_id for c in close for kind in self.KINDS for name,member_id in self.prefixed(kind, c) if name == c))
+
+	def best(self, query):
+		matches = self.search(query)
+		return matches[0] if matches else None
@@ -0,0 +1,51 @@
+from collections import deque
+
+# ids and times of the messages the bot has posted, newest last, so nothing has to scan channel history for them
+
+SCHEMA = "posts (channel int, message int, posted_at int, PRIMARY KEY (channel, message)) WITHOUT ROWID"
+
+# per channel, the same window the old history scans looked at
+KEEP = 100
+
+
+class PostLedger():
+	def __init__(self):
+		self.channels = {}
+
+	def add(self, channel_id, message_id, posted_at):
+		if channel_id not in self.channels:
+			self.channels[channel_id] = deque(maxlen=KEEP)
+		self.channels[channel_id].append((message_id, posted_at))
+
+	def known(self, channel_id):
+		return channel_id in self.channels
+
+	def last(self, channel_id):
+		posts = self.channels.get(channel_id)
+		return posts[-1] if posts else None
+
+	def posts(self, channel_id):
+		return list(self.channels.get(channel_id, ()))
+
+	def remove(self, channel_id, message_ids):
+		if channel_id in self.channels:
+			self.channels[channel_id] = deque((p for p in self.channels[channel_id] if p[0] not in message_ids), maxlen=KEEP)
+
+	def seed(self, rows):
+		for channel_id,message_id,posted_at in rows:
+			self.add(channel_id, message_id, posted_at)
+
+
+def save(con, channel_id, message_id, posted_at):
+	con.execute("INSERT OR REPLACE INTO posts (channel, message, posted_at) VALUES (?,?,?)", [channel_id, message_id, posted_at])
+	con.execute("DELETE FROM posts WHERE channel = ? AND message NOT IN (SELECT message FROM posts WHERE channel = ? ORDER BY message DESC LIMIT ?)", [channel_id, channel_id, KEEP])
+
+
+def delete(con, channel_id, message_ids):
+	con.executemany("DELETE FROM posts WHERE channel = ? AND message = ?", [(channel_id, i) for i in message_ids])
+
+
+# trims each channel to its newest KEEP posts and returns them oldest first
+def load(con):
+	con.execute("DELETE FROM posts WHERE (channel, message) NOT IN (SELECT channel, message FROM (SELECT channel, message, ROW_NUMBER() OVER (PARTITION BY channel ORDER BY message DESC) AS n FROM posts) WHERE n <= ?)", [KEEP])
+	return con.execute("SELECT channel, message, posted_at FROM posts ORDER BY channel, message").fetchall()
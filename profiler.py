@@ -0,0 +1,38 @@
+import cProfile
+import io
+import pstats
+
+
+# profiles the next few runs of one coroutine function, then hands the capture to done()
+class Capture():
+	def __init__(self, name, runs, done):
+		self.name = name
+		self.runs = runs
+		self.done = done
+		self.profile = cProfile.Profile()
+		self.active = 0
+		self.finished = False
+
+	# overlapping runs share one enable/disable so the profiler is never switched on twice
+	def wrap(self, fn):
+		async def profiled(*args, **kwargs):
+			if not self.active:
+				self.profile.enable()
+			self.active += 1
+			try:
+				return await fn(*args, **kwargs)
+			finally:
+				self.active -= 1
+				if not self.active:
+					self.profile.disable()
+				self.runs -= 1
+				if self.runs <= 0 and not self.active and not self.finished:
+					self.finished = True
+					await self.done(self)
+		profiled.original = fn
+		return profiled
+
+	def summary(self, limit=30):
+		out = io.StringIO()
+		pstats.Stats(self.profile, stream=out).strip_dirs().sort_stats('cumulative').print_stats(limit)
+		return out.getvalue()
@@ -0,0 +1,29 @@
+import bisect
+import random
+
+
+# weighted draw over ticket counts without expanding one entry per ticket
+class Raffle():
+	def __init__(self, entries, weights, constraint=None):
+		entries = [(e,w) for e,w in zip(entries,weights) if not constraint or constraint(e)]
+		if entries and not any(w > 0 for e,w in entries):
+			entries = [(e,1) for e,w in entries]
+
+		self.entries = []
+		self.cumulative = []
+		self.total = 0
+		for e,w in entries:
+			if w <= 0:
+				continue
+			self.total += w
+			self.entries.append(e)
+			self.cumulative.append(self.total)
+
+	def __len__(self):
+		return self.total
+
+	def draw(self, rng=random):
+		if not self.entries:
+			raise IndexError("cannot draw from an empty raffle")
+		ticket = rng.randrange(self.total)
+		return self.entries[bisect.bisect_right(self.cumulative, ticket)]
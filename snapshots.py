@@ -0,0 +1,75 @@
+from array import array
+
+# raffle odds as they stood at each bestowment, stored as deltas against the previous snapshot
+# tickets are ceiling - base, and only the bestower, bestowee, their ancestors and inactivity changes move a member's base,
+# so a delta only holds the members whose base changed plus the ones who stopped being eligible
+
+SCHEMA = "raffle_snapshots (bestowment_id int PRIMARY KEY, full int, ceiling int, members blob, bases blob, removed blob)"
+
+# every this many bestowments a full snapshot is stored, so a lookup never replays more than this many deltas
+KEYFRAME_EVERY = 50
+
+
+def pack(values):
+	return array('q', values).tobytes()
+
+
+def unpack(blob):
+	values = array('q')
+	values.frombytes(blob)
+	return values.tolist()
+
+
+# (ceiling, {member id: base}) for the stats a raffle was drawn from
+def bases(mstats):
+	current = {m['id']: m['effective_touch']+m['bestowments']+m['children'] for m in mstats}
+	ceiling = mstats[0]['tickets']+current[mstats[0]['id']] if mstats else 0
+	return ceiling, current
+
+
+# previous is (bestowment id, keyframe id, bases) for the last snapshot, or None; returns this snapshot's keyframe id
+def save(con, bestowment_id, ceiling, current, previous):
+	if not previous or bestowment_id-previous[1] >= KEYFRAME_EVERY:
+		keyframe, changed, removed = bestowment_id, current, []
+	else:
+		keyframe = previous[1]
+		changed = {i: b for i,b in current.items() if previous[2].get(i) != b}
+		removed = [i for i in previous[2] if i not in current]
+	con.execute("INSERT OR REPLACE INTO raffle_snapshots (bestowment_id, full, ceiling, members, bases, removed) VALUES (?,?,?,?,?,?)",
+		[bestowment_id, keyframe == bestowment_id, ceiling, pack(changed.keys()), pack(changed.values()), pack(removed)])
+	return keyframe
+
+
+# replays from the nearest keyframe; (ceiling, keyframe id, bases) or None if bestowment_id has no snapshot
+def load(con, bestowment_id):
+	rows = con.execute("""SELECT bestowment_id, full, ceiling, members, bases, removed FROM raffle_snapshots
+		WHERE bestowment_id <= ? AND bestowment_id >= (SELECT MAX(bestowment_id) FROM raffle_snapshots WHERE full = 1 AND bestowment_id <= ?)
+		ORDER BY bestowment_id""", [bestowment_id, bestowment_id]).fetchall()
+	if not rows or rows[-1][0] != bestowment_id:
+		return None
+	current = {}
+	for i,full,ceiling,members,member_bases,removed in rows:
+		if full:
+			current = {}
+		for member in unpack(removed):
+			current.pop(member, None)
+		current.update(zip(unpack(members), unpack(member_bases)))
+	return rows[-1][2], rows[0][0], current
+
+
+# (bestowment id, keyframe id, bases) for the newest snapshot, the previous argument for the next save
+def latest(con):
+	row = con.execute("SELECT MAX(bestowment_id) FROM raffle_snapshots").fetchall()[0]
+	if row[0] is None:
+		return None
+	ceiling, keyframe, current = load(con, row[0])
+	return row[0], keyframe, current
+
+
+# [(member id, tickets, chance)], likeliest first
+def odds(ceiling, current):
+	tickets = [(i, ceiling-b) for i,b in current.items()]
+	total = sum(t for i,t in tickets)
+	rows = [(i, t, t/total if total else 1/len(tickets)) for i,t in tickets]
+	rows.sort(key=lambda r: r[2], reverse=True)
+	return rows